@@ -0,0 +1,124 @@
+# accounts.py - 多账户配置
+# 一个进程同步多个 Bitget (子) 账户，各自写入自己的飞书表，或写入同一张表并用账户列区分
+
+import os
+import json
+from dotenv import load_dotenv
+
+import analytics
+import bitget_client
+import feishu_client
+from fill_ledger import FillLedger, FILL_TABLE_ID
+from outbox import Outbox
+
+load_dotenv()
+
+# 账户列表文件 (JSON)，为空时使用 BITGET_* 环境变量的单账户模式
+ACCOUNTS_FILE = os.getenv("ACCOUNTS_FILE", "")
+# 多个账户写入同一张表时用于区分账户的列名，为空则不写该列
+ACCOUNT_FIELD = os.getenv("FEISHU_ACCOUNT_FIELD", "")
+
+
+class SyncAccount:
+    """
+    一个同步目标: Bitget 账户 + 飞书表 + 独立的同步状态 / 记录索引 / 发件箱
+    所有账户共享 Bitget 连接池、事件循环与飞书客户端 (tenant_access_token 缓存)
+    """
+
+    def __init__(self, bitget: bitget_client.BitgetAccount, state, table_id: str = None, app_token: str = None,
+                 fill_table_id: str = None):
+        self.name = bitget.name
+        self.bitget = bitget
+        self.state = state
+        self.table_id = table_id
+        self.app_token = app_token
+        # 成交明细表 (为空时不启用成交账本)
+        self.fill_table_id = fill_table_id or FILL_TABLE_ID
+        self.fill_ledger = None
+        # 已平仓仓位导出文件 (供 analytics 统计)
+        self.history_export = analytics.export_path(None if bitget is bitget_client.default_account else self.name)
+        # positionId -> record_id 的内存索引 (从飞书批量预取)
+        # None 表示尚未加载或加载失败，此时回退到逐条 find_record
+        self.record_index = None
+        self.outbox = None
+        # 最近一份持仓快照与上次按标记价格刷新浮动盈亏的时间 (monotonic)
+        self.open_positions = []
+        self.last_mark_refresh = 0.0
+
+    def start(self):
+        self.outbox = Outbox(self.state, on_created=self.remember_record_id,
+                             table_id=self.table_id, app_token=self.app_token,
+                             lookup=self.find_existing_record).start()
+        if self.fill_table_id:
+            self.fill_ledger = FillLedger(self, self.fill_table_id).start()
+        return self
+
+    def stop(self):
+        if self.fill_ledger is not None:
+            self.fill_ledger.stop()
+        if self.outbox is not None:
+            self.outbox.stop()
+        self.state.flush()
+
+    def prefetch_record_index(self):
+        """启动时 / 缓存丢失时批量加载飞书记录索引"""
+        try:
+            self.record_index = feishu_client.load_record_index(self.table_id, self.app_token,
+                                                                match=self.record_match())
+        except Exception as e:
+            print(f"[飞书] 预取记录索引失败，回退到逐条查询: {e}")
+            self.record_index = None
+
+    def remember_record_id(self, unique_id: str, record_id: str):
+        """发件箱创建记录成功后回填内存索引"""
+        if self.record_index is not None:
+            self.record_index[unique_id] = record_id
+
+    def lookup_record_id(self, unique_id: str) -> str:
+        """优先查内存索引，索引不可用时才调用 search 接口"""
+        if self.record_index is not None:
+            return self.record_index.get(unique_id)
+        return feishu_client.find_record(unique_id, self.table_id, self.app_token, match=self.record_match())
+
+    def find_existing_record(self, unique_id: str) -> str:
+        """
+        发件箱重发结果未知的创建前确认记录是否已存在
+        索引未命中时仍实时查询一次: 超时的创建可能已在飞书生效，但没有回填到索引
+        """
+        record_id = self.lookup_record_id(unique_id)
+        if record_id or self.record_index is None:
+            return record_id
+        return feishu_client.find_record(unique_id, self.table_id, self.app_token, match=self.record_match())
+
+    def is_settled(self, unique_id: str) -> bool:
+        """已完结，或完结写入已持久化在发件箱中等待发送"""
+        return self.state.is_finalized(unique_id) or \
+            (self.outbox is not None and self.outbox.has_pending_final(unique_id))
+
+    def record_match(self) -> dict:
+        """共用一张表时查询记录只看本账户的行 (按账户列过滤)"""
+        return {ACCOUNT_FIELD: self.name} if ACCOUNT_FIELD else None
+
+    def tag(self, fields: dict) -> dict:
+        """共用一张表时写入账户列"""
+        if ACCOUNT_FIELD:
+            fields[ACCOUNT_FIELD] = self.name
+        return fields
+
+
+def load_account_configs() -> list:
+    """
+    读取 ACCOUNTS_FILE，格式:
+    [{"name": "sub1", "api_key": "...", "secret_key": "...", "passphrase": "...",
+      "table_id": "tblxxx", "app_token": "basexxx", "fill_table_id": "tblyyy"}, ...]
+    table_id / app_token / fill_table_id 可省略，省略时使用 FEISHU_TABLE_ID / FEISHU_APP_TOKEN / FEISHU_FILL_TABLE_ID
+    未配置时返回空列表 (单账户模式)
+    """
+    if not ACCOUNTS_FILE:
+        return []
+    with open(ACCOUNTS_FILE, 'r', encoding='utf-8') as f:
+        configs = json.load(f)
+    names = [config["name"] for config in configs]
+    if len(set(names)) != len(names):
+        raise ValueError(f"{ACCOUNTS_FILE} 中的账户名重复: {names}")
+    return configs
@@ -0,0 +1,319 @@
+# analytics.py - 交易统计
+# 把已平仓仓位加载成列式数组 (NumPy)，向量化计算胜率 / 期望 / 最大回撤 / 持仓时长分布 / 杠杆分档等指标，
+# 并把汇总写入飞书统计表
+#
+# 数据来源: 主程序完结仓位时追加写入的导出文件 (HISTORY_EXPORT, 每行一个 JSON)
+#
+# 用法:
+#   python analytics.py              # 计算并打印 (配置了 FEISHU_SUMMARY_TABLE_ID 时同时写入飞书)
+#   python analytics.py --refresh    # 先从 Bitget 拉取最近 90 天的历史仓位补全导出文件
+
+import os
+import sys
+import json
+import time
+from datetime import datetime
+from dotenv import load_dotenv
+
+import contracts
+
+# NumPy 只在统计函数内部导入: 同步进程只用到导出相关的纯 JSON 函数 (export_path / closed_record / append_closed)，
+# 不为它承担 NumPy 的导入耗时
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
+load_dotenv()
+
+# 已平仓仓位导出文件 (多账户模式下为 closed_positions_<账户>.jsonl)
+HISTORY_EXPORT = os.getenv("HISTORY_EXPORT", "closed_positions.jsonl")
+# 统计表，为空时只打印不写入
+SUMMARY_TABLE_ID = os.getenv("FEISHU_SUMMARY_TABLE_ID", "")
+# 杠杆分档边界: 1-4x / 5-9x / 10-19x / 20-49x / 50x+
+LEVERAGE_BINS = [5, 10, 20, 50]
+HOLDING_PERCENTILES = [25, 50, 75, 90]
+
+NUMERIC_COLUMNS = ("ctime", "utime", "pnl", "margin", "leverage")
+TEXT_COLUMNS = ("positionId", "symbol", "holdSide")
+COLUMNS = NUMERIC_COLUMNS + TEXT_COLUMNS
+
+
+def export_path(account: str = None) -> str:
+    if not account:
+        return HISTORY_EXPORT
+    root, ext = os.path.splitext(HISTORY_EXPORT)
+    return f"{root}_{account}{ext}"
+
+
+def closed_record(pos: dict) -> dict:
+    """
+    把一条历史仓位压缩成导出记录
+    收益与保证金的口径与 main.sync_history_positions 一致: 优先净收益，保证金见 contracts.ContractCache.margin
+    """
+    c_time_ms = int(pos.get("ctime") or pos.get("cTime") or 0)
+    net_profit = float(pos.get("netProfit", 0))
+    leverage = int(pos.get("leverage", 0))
+    total_vol = float(pos.get("openTotalPos", 0))
+    open_avg = float(pos.get("openAvgPrice", 0))
+    return {
+        # 与 main.get_unique_id 相同: {symbol}_{holdSide}_{cTime}
+        "positionId": f"{pos.get('symbol', '')}_{pos.get('holdSide', '')}_{c_time_ms}",
+        "symbol": pos.get("symbol", ""),
+        "holdSide": pos.get("holdSide", ""),
+        "ctime": c_time_ms,
+        "utime": int(pos.get("utime") or pos.get("uTime") or 0),
+        "pnl": net_profit if net_profit != 0 else float(pos.get("pnl", 0)),
+        "margin": contracts.cache.margin(pos.get("symbol", ""), open_avg, total_vol, leverage),
+        "leverage": leverage,
+    }
+
+
+def append_closed(path: str, records: list):
+    """追加导出记录 (同一仓位重复写入时，加载时只保留最后一条)"""
+    if not records:
+        return
+    with open(path, 'a', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n")
+
+
+def _empty_columns() -> dict:
+    import numpy as np
+
+    columns = {name: np.zeros(0, dtype=np.float64) for name in NUMERIC_COLUMNS}
+    columns.update({name: np.zeros(0, dtype=str) for name in TEXT_COLUMNS})
+    return columns
+
+
+def _to_columns(rows: list) -> dict:
+    import numpy as np
+
+    columns = {name: np.fromiter((float(row.get(name) or 0) for row in rows), dtype=np.float64, count=len(rows))
+               for name in NUMERIC_COLUMNS}
+    columns.update({name: np.array([str(row.get(name, "")) for row in rows], dtype=str) for name in TEXT_COLUMNS})
+    return columns
+
+
+def _dedupe(columns: dict) -> dict:
+    """同一 positionId 只保留最后一条，并按平仓时间排序 (回撤需要时间顺序)"""
+    import numpy as np
+
+    ids = columns["positionId"][::-1]
+    _, first = np.unique(ids, return_index=True)
+    keep = len(ids) - 1 - first
+    order = keep[np.argsort(columns["utime"][keep], kind="stable")]
+    return {name: values[order] for name, values in columns.items()}
+
+
+def load_columns(path: str = HISTORY_EXPORT) -> dict:
+    """
+    读取导出文件为列式数组
+    解析结果连同已解析的字节偏移缓存在 <path>.npz，之后只解析新追加的行
+    """
+    import numpy as np
+
+    cache_path = path + ".npz"
+    columns, offset = _empty_columns(), 0
+    if os.path.exists(cache_path):
+        try:
+            with np.load(cache_path, allow_pickle=False) as data:
+                offset = int(data["offset"])
+                columns = {name: data[name] for name in COLUMNS}
+        except Exception as e:
+            print(f"[Core] 统计缓存损坏，重新解析: {e}")
+            columns, offset = _empty_columns(), 0
+    if not os.path.exists(path):
+        return columns
+
+    size = os.path.getsize(path)
+    if size < offset:
+        # 导出文件被截断或替换
+        columns, offset = _empty_columns(), 0
+    if size == offset:
+        return columns
+
+    rows = []
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        for line in f:
+            if not line.endswith(b"\n"):
+                # 正在写入的半行，留到下次
+                break
+            offset += len(line)
+            try:
+                rows.append(_loads(line))
+            except ValueError:
+                continue
+    new = _to_columns(rows)
+    columns = _dedupe({name: np.concatenate([columns[name], new[name]]) for name in COLUMNS})
+
+    tmp_path = cache_path + ".tmp.npz"
+    np.savez(tmp_path, offset=offset, **columns)
+    os.replace(tmp_path, cache_path)
+    return columns
+
+
+def _group(keys, pnl, wins, minlength: int = 0):
+    import numpy as np
+
+    counts = np.bincount(keys, minlength=minlength)
+    sums = np.bincount(keys, weights=pnl, minlength=minlength)
+    win_counts = np.bincount(keys, weights=wins, minlength=minlength)
+    win_rate = np.divide(win_counts, counts, out=np.zeros(len(counts)), where=counts > 0)
+    return counts, sums, win_rate
+
+
+def compute_summary(columns: dict) -> dict:
+    """全部指标都是整列的向量化运算，没有逐行循环"""
+    import numpy as np
+
+    pnl = columns["pnl"]
+    count = len(pnl)
+    if count == 0:
+        return {"count": 0}
+    wins = pnl > 0
+    losses = pnl < 0
+    gross_profit = pnl[wins].sum()
+    gross_loss = -pnl[losses].sum()
+
+    # 按平仓时间累计的权益曲线，回撤 = 历史峰值 - 当前权益 (起点 0)
+    equity = np.cumsum(pnl)
+    peak = np.maximum.accumulate(np.maximum(equity, 0))
+    drawdown = peak - equity
+
+    margin = columns["margin"]
+    roe = np.divide(pnl, margin, out=np.zeros(count), where=margin > 0)
+    holding_minutes = np.maximum(columns["utime"] - columns["ctime"], 0) / 60000.0
+
+    symbols, symbol_keys = np.unique(columns["symbol"], return_inverse=True)
+    symbol_counts, symbol_pnl, symbol_win_rate = _group(symbol_keys, pnl, wins)
+    symbol_order = np.argsort(-symbol_pnl, kind="stable")
+
+    leverage_keys = np.digitize(columns["leverage"], LEVERAGE_BINS)
+    edges = [1] + LEVERAGE_BINS
+    leverage_labels = [f"{lo}-{hi - 1}x" for lo, hi in zip(edges, LEVERAGE_BINS)] + [f"{LEVERAGE_BINS[-1]}x+"]
+    leverage_counts, leverage_pnl, leverage_win_rate = _group(leverage_keys, pnl, wins, len(leverage_labels))
+
+    return {
+        "count": count,
+        "win_rate": float(wins.mean()),
+        "total_pnl": float(pnl.sum()),
+        "avg_win": float(pnl[wins].mean()) if wins.any() else 0.0,
+        "avg_loss": float(pnl[losses].mean()) if losses.any() else 0.0,
+        # 期望 = 胜率 * 平均盈利 + 败率 * 平均亏损 = 平均每笔收益
+        "expectancy": float(pnl.mean()),
+        "profit_factor": float(gross_profit / gross_loss) if gross_loss > 0 else float("inf"),
+        "avg_roe": float(roe.mean()),
+        "max_drawdown": float(drawdown.max()),
+        "holding_minutes": {p: float(v) for p, v in
+                            zip(HOLDING_PERCENTILES, np.percentile(holding_minutes, HOLDING_PERCENTILES))},
+        "by_symbol": [
+            {"symbol": str(symbols[i]), "count": int(symbol_counts[i]),
+             "win_rate": float(symbol_win_rate[i]), "pnl": float(symbol_pnl[i])}
+            for i in symbol_order
+        ],
+        "by_leverage": [
+            {"bucket": label, "count": int(leverage_counts[i]),
+             "win_rate": float(leverage_win_rate[i]), "pnl": float(leverage_pnl[i])}
+            for i, label in enumerate(leverage_labels) if leverage_counts[i] > 0
+        ],
+    }
+
+
+def summary_rows(summary: dict, prefix: str = "") -> list:
+    """
+    转成统计表的行，"指标" 列作为唯一键 (多账户时带 "<账户>/" 前缀)
+    表中需要的列: 指标 / 分类 / 笔数 / 胜率 / 收益额 / 数值 / 更新时间
+    """
+    now_ms = int(time.time() * 1000)
+    count = summary.get("count", 0)
+
+    def row(name, category, **values):
+        return dict({"指标": prefix + name, "分类": category, "更新时间": now_ms}, **values)
+
+    if count == 0:
+        return [row("总笔数", "总览", 笔数=0)]
+    profit_factor = summary["profit_factor"]
+    rows = [
+        row("总笔数", "总览", 笔数=count, 胜率=round(summary["win_rate"], 4), 收益额=round(summary["total_pnl"], 4)),
+        row("期望收益", "总览", 数值=round(summary["expectancy"], 4)),
+        row("平均盈利", "总览", 数值=round(summary["avg_win"], 4)),
+        row("平均亏损", "总览", 数值=round(summary["avg_loss"], 4)),
+        row("盈亏比", "总览", 数值=round(profit_factor, 4) if profit_factor != float("inf") else None),
+        row("平均收益率", "总览", 数值=round(summary["avg_roe"], 4)),
+        row("最大回撤", "总览", 数值=round(summary["max_drawdown"], 4)),
+    ]
+    rows += [row(f"持仓时长 P{p} (分钟)", "持仓时长", 数值=round(v, 1)) for p, v in summary["holding_minutes"].items()]
+    rows += [row(f"币种:{item['symbol']}", "币种", 笔数=item["count"],
+                 胜率=round(item["win_rate"], 4), 收益额=round(item["pnl"], 4)) for item in summary["by_symbol"]]
+    rows += [row(f"杠杆:{item['bucket']}", "杠杆", 笔数=item["count"],
+                 胜率=round(item["win_rate"], 4), 收益额=round(item["pnl"], 4)) for item in summary["by_leverage"]]
+    return rows
+
+
+def push_summary(rows: list, table_id: str = SUMMARY_TABLE_ID, app_token: str = None):
+    """按 "指标" 列 upsert 到飞书统计表"""
+    import feishu_client
+
+    index = feishu_client.load_record_index(table_id, app_token, key_field="指标")
+    updates = [(index[fields["指标"]], fields) for fields in rows if fields["指标"] in index]
+    creates = [fields for fields in rows if fields["指标"] not in index]
+    if updates:
+        feishu_client.batch_update_records(updates, table_id, app_token)
+    if creates:
+        feishu_client.batch_create_records(creates, table_id, app_token)
+
+
+def refresh_export(bitget_account, path: str):
+    """从 Bitget 拉取最近 90 天 (所有合约类型) 的历史仓位追加到导出文件"""
+    import bitget_client
+
+    # 币本位合约的保证金口径依赖合约元数据
+    contracts.cache.ensure(bitget_account, bitget_client.PRODUCT_TYPES)
+    since = int(time.time() * 1000) - 90 * 86400 * 1000 + 60000
+    history = bitget_account.fetch_history({t: since for t in bitget_client.PRODUCT_TYPES})
+    records = [closed_record(pos) for positions in history.values() for pos in positions]
+    append_closed(path, records)
+    print(f"[Bitget] {bitget_account.name}: 导出历史仓位 {len(records)} 条")
+
+
+def print_summary(name: str, summary: dict):
+    print(f"\n===== {name} ({datetime.now().strftime('%Y-%m-%d %H:%M:%S')}) =====")
+    if summary["count"] == 0:
+        print("暂无已平仓记录")
+        return
+    print(f"笔数 {summary['count']}  胜率 {summary['win_rate']:.2%}  总收益 {summary['total_pnl']:.4f}")
+    print(f"期望 {summary['expectancy']:.4f}  盈亏比 {summary['profit_factor']:.2f}  最大回撤 {summary['max_drawdown']:.4f}")
+    print("持仓时长 (分钟): " + "  ".join(f"P{p} {v:.1f}" for p, v in summary["holding_minutes"].items()))
+    for item in summary["by_symbol"][:10]:
+        print(f"  {item['symbol']:<14} {item['count']:>6} 笔  胜率 {item['win_rate']:.2%}  收益 {item['pnl']:.4f}")
+    for item in summary["by_leverage"]:
+        print(f"  {item['bucket']:<14} {item['count']:>6} 笔  胜率 {item['win_rate']:.2%}  收益 {item['pnl']:.4f}")
+
+
+def main(argv):
+    import bitget_client
+    from accounts import load_account_configs
+
+    configs = load_account_configs()
+    targets = [(None, None, bitget_client.default_account)] if not configs else [
+        (config["name"], config.get("app_token"),
+         bitget_client.BitgetAccount(config["name"], config["api_key"], config["secret_key"], config["passphrase"]))
+        for config in configs
+    ]
+    for name, app_token, bitget_account in targets:
+        path = export_path(name)
+        if "--refresh" in argv:
+            refresh_export(bitget_account, path)
+        start = time.perf_counter()
+        summary = compute_summary(load_columns(path))
+        print_summary(name or "default", summary)
+        print(f"(耗时 {(time.perf_counter() - start) * 1000:.1f} ms)")
+        if SUMMARY_TABLE_ID:
+            push_summary(summary_rows(summary, f"{name}/" if name else ""), SUMMARY_TABLE_ID, app_token)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,78 @@
+# bench_analytics.py - 交易统计基准测试
+# 生成 N 条合成的已平仓记录，对比逐行循环与向量化实现，并测量导出文件的冷 / 热加载耗时
+#
+# 用法:
+#   python benchmarks/bench_analytics.py            # 默认 100000 条
+#   python benchmarks/bench_analytics.py 500000
+
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import analytics
+
+
+def synthetic_records(n, seed=7):
+    rng = random.Random(seed)
+    symbols = ["BTCUSDT", "ETHUSDT", "SOLUSDT", "DOGEUSDT", "XRPUSDT", "BNBUSDT", "ADAUSDT", "LINKUSDT"]
+    t = 1_700_000_000_000
+    records = []
+    for i in range(n):
+        c_time = t + i * 60_000
+        leverage = rng.choice([3, 5, 10, 20, 25, 50, 100])
+        margin = rng.uniform(10, 500)
+        records.append({
+            "positionId": f"{rng.choice(symbols)}_long_{c_time}",
+            "symbol": rng.choice(symbols),
+            "holdSide": rng.choice(["long", "short"]),
+            "ctime": c_time,
+            "utime": c_time + rng.randint(10_000, 86_400_000),
+            "pnl": rng.gauss(0.5, 20),
+            "margin": margin,
+            "leverage": leverage,
+        })
+    return records
+
+
+def row_by_row(records):
+    """逐行实现: 与 analytics.compute_summary 口径一致的纯 Python 循环"""
+    records = sorted(records, key=lambda r: r["utime"])
+    wins = equity = peak = max_dd = 0.0
+    by_symbol = {}
+    for r in records:
+        pnl = r["pnl"]
+        wins += pnl > 0
+        equity += pnl
+        peak = max(peak, equity)
+        max_dd = max(max_dd, peak - equity)
+        stats = by_symbol.setdefault(r["symbol"], [0, 0.0])
+        stats[0] += 1
+        stats[1] += pnl
+    holding = sorted((r["utime"] - r["ctime"]) / 60000.0 for r in records)
+    return wins / len(records), max_dd, by_symbol, holding[len(holding) // 2]
+
+
+def bench(name, fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    elapsed = time.perf_counter() - start
+    print(f"{name:24s} {elapsed * 1000:9.1f} ms")
+    return result, elapsed
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    records = synthetic_records(n)
+    print(f"records: {n}")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "closed_positions.jsonl")
+        analytics.append_closed(path, records)
+        columns, _ = bench("load (cold, parse)", analytics.load_columns, path)
+        columns, _ = bench("load (warm, npz)", analytics.load_columns, path)
+    _, loop = bench("summary (row loop)", row_by_row, records)
+    _, vec = bench("summary (vectorized)", analytics.compute_summary, columns)
+    print(f"speedup: {loop / vec:.1f}x")
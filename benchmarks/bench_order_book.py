@@ -0,0 +1,126 @@
+# bench_order_book.py - 本地盘口引擎基准测试
+# 回放 books 频道的推送 (snapshot + update)，对比旧版整本重建 + 字符串拼接校验的实现
+#
+# 用法:
+#   python benchmarks/bench_order_book.py                 # 使用合成数据
+#   python benchmarks/bench_order_book.py frames.jsonl    # 回放录制的原始 WS 消息 (每行一条)
+
+import json
+import os
+import random
+import sys
+import time
+from zlib import crc32
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bitget.ws.order_book import OrderBook
+
+
+class LegacyBook:
+    """旧版 BooksInfo 的算法: 每次更新重建字典并对全部价格重新排序，校验串逐段拼接"""
+
+    def __init__(self, asks, bids):
+        self.asks = asks
+        self.bids = bids
+
+    def merge(self, asks, bids):
+        self.asks = self._merge(self.asks, asks, False)
+        self.bids = self._merge(self.bids, bids, True)
+
+    @staticmethod
+    def _merge(all_list, update_list, is_reverse):
+        price_and_value = {v[0]: v for v in all_list}
+        for v in update_list:
+            if v[1] == "0":
+                price_and_value.pop(v[0], None)
+                continue
+            price_and_value[v[0]] = v
+        keys = sorted(price_and_value.keys(), key=float, reverse=is_reverse)
+        return [price_and_value[k] for k in keys]
+
+    def check_sum(self):
+        crc32str = ''
+        for x in range(25):
+            if x < len(self.bids):
+                crc32str = crc32str + self.bids[x][0] + ":" + self.bids[x][1] + ":"
+            if x < len(self.asks):
+                crc32str = crc32str + self.asks[x][0] + ":" + self.asks[x][1] + ":"
+        value = crc32(bytes(crc32str[:-1], encoding="utf8"))
+        return value - (1 << 32) if value >= (1 << 31) else value
+
+
+def synthetic_frames(levels=400, updates=20000, changes=8, seed=7):
+    """生成一份 snapshot + N 条 update，带正确的校验和"""
+    rng = random.Random(seed)
+    mid = 30000.0
+    book = OrderBook()
+    asks = [["%.1f" % (mid + 0.5 * (i + 1)), "%.3f" % rng.uniform(0.01, 5)] for i in range(levels)]
+    bids = [["%.1f" % (mid - 0.5 * (i + 1)), "%.3f" % rng.uniform(0.01, 5)] for i in range(levels)]
+    book.snapshot(asks, bids)
+    frames = [{"action": "snapshot", "data": [{"asks": asks, "bids": bids, "checksum": book.checksum()}]}]
+    for _ in range(updates):
+        upd_asks, upd_bids = [], []
+        for _ in range(changes):
+            side = upd_asks if rng.random() < 0.5 else upd_bids
+            sign = 1 if side is upd_asks else -1
+            price = "%.1f" % (mid + sign * 0.5 * rng.randint(1, levels))
+            size = "0" if rng.random() < 0.2 else "%.3f" % rng.uniform(0.01, 5)
+            side.append([price, size])
+        book.update(upd_asks, upd_bids)
+        frames.append({"action": "update", "data": [{"asks": upd_asks, "bids": upd_bids, "checksum": book.checksum()}]})
+    return frames
+
+
+def load_frames(path):
+    frames = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            msg = json.loads(line)
+            if msg.get("arg", {}).get("channel") == "books" and "action" in msg:
+                frames.append(msg)
+    return frames
+
+
+def run_new(frames):
+    book = OrderBook()
+    mismatches = 0
+    for frame in frames:
+        data = frame["data"][0]
+        if frame["action"] == "snapshot":
+            book.snapshot(data["asks"], data["bids"])
+        else:
+            book.update(data["asks"], data["bids"])
+            if not book.verify(data["checksum"]):
+                mismatches += 1
+    return mismatches
+
+
+def run_legacy(frames):
+    book = None
+    mismatches = 0
+    for frame in frames:
+        data = frame["data"][0]
+        if frame["action"] == "snapshot":
+            book = LegacyBook(data["asks"], data["bids"])
+        else:
+            book.merge(data["asks"], data["bids"])
+            if book.check_sum() != int(data["checksum"]):
+                mismatches += 1
+    return mismatches
+
+
+def bench(name, fn, frames):
+    start = time.perf_counter()
+    mismatches = fn(frames)
+    elapsed = time.perf_counter() - start
+    print(f"{name:8s} {elapsed * 1000:9.1f} ms  {elapsed / len(frames) * 1e6:8.2f} us/frame  checksum mismatches: {mismatches}")
+    return elapsed
+
+
+if __name__ == "__main__":
+    frames = load_frames(sys.argv[1]) if len(sys.argv) > 1 else synthetic_frames()
+    print(f"frames: {len(frames)}")
+    legacy = bench("legacy", run_legacy, frames)
+    new = bench("engine", run_new, frames)
+    print(f"speedup: {legacy / new:.1f}x")
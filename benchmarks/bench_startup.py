@@ -0,0 +1,41 @@
+# bench_startup.py - 冷启动基准测试
+# 每次在新的解释器进程中测量导入耗时 (取中位数)，对比延迟导入与启动时就导入飞书 SDK / PyCryptodome / NumPy 的差别
+#
+# 用法:
+#   python benchmarks/bench_startup.py        # 默认每项 5 次
+#   python benchmarks/bench_startup.py 10
+
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CASES = [
+    ("import feishu_client (延迟导入 SDK)", "import feishu_client"),
+    ("import feishu_client + 创建客户端", "import feishu_client; feishu_client.get_client()"),
+    ("import bitget.utils (HMAC 签名)", "import bitget.utils"),
+    ("import bitget.utils + PyCryptodome", "import bitget.utils; import Crypto.PublicKey.RSA, Crypto.Signature.PKCS1_v1_5"),
+    ("import analytics (延迟导入 NumPy)", "import analytics"),
+    ("import analytics + NumPy", "import analytics; import numpy"),
+    ("import main (延迟导入)", "import main"),
+    ("import main + 启动时导入飞书 SDK", "import main; main.feishu_client.get_client()"),
+]
+
+
+def measure(code: str) -> float:
+    """在新进程中执行 code，返回耗时 (毫秒)，不含解释器本身的启动"""
+    script = f"import time; _t = time.perf_counter(); {code}; print((time.perf_counter() - _t) * 1000)"
+    out = subprocess.run([sys.executable, "-c", script], cwd=ROOT, capture_output=True, text=True, check=True)
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def main(runs: int):
+    for name, code in CASES:
+        samples = [measure(code) for _ in range(runs)]
+        print(f"{name:<40} {statistics.median(samples):8.1f} ms")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
@@ -0,0 +1,14 @@
+#!/usr/bin/python
+from bitget.async_client import AsyncClient
+from bitget.consts import GET, POST
+
+
+class AsyncBitgetApi(AsyncClient):
+    def __init__(self, api_key, api_secret_key, passphrase, use_server_time=False, first=False, **kwargs):
+        AsyncClient.__init__(self, api_key, api_secret_key, passphrase, use_server_time, first, **kwargs)
+
+    async def post(self, request_path, params):
+        return await self._request_with_params(POST, request_path, params)
+
+    async def get(self, request_path, params):
+        return await self._request_with_params(GET, request_path, params)
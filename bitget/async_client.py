@@ -0,0 +1,140 @@
+import asyncio
+import json
+import logging
+
+import aiohttp
+
+from . import consts as c, utils, exceptions
+from .log import debug_sampled, redact_header
+
+logger = logging.getLogger(__name__)
+
+
+class _AsyncResponse(object):
+    # 把 aiohttp 的响应适配成 exceptions.BitgetAPIException 需要的接口
+    def __init__(self, status_code, text, headers):
+        self.status_code = status_code
+        self.text = text
+        self.headers = headers
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class AsyncClient(object):
+
+    def __init__(self, api_key, api_secret_key, passphrase, use_server_time=False, first=False,
+                 session=None, pool_size=c.HTTP_POOL_SIZE, timeout=None, max_retries=c.HTTP_MAX_RETRIES,
+                 rate_limiter=None):
+
+        self.API_KEY = api_key
+        self.API_SECRET_KEY = api_secret_key
+        self.PASSPHRASE = passphrase
+        self.use_server_time = use_server_time
+        self.first = first
+        self.pool_size = pool_size
+        self.max_retries = max_retries
+        connect_timeout, read_timeout = timeout if timeout is not None else (c.HTTP_CONNECT_TIMEOUT, c.HTTP_READ_TIMEOUT)
+        self.timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+        # aiohttp 的 session 必须在事件循环内创建, 未传入时首次请求再懒加载
+        # 可选的限流器 (acquire / on_rate_limited / on_success), 按接口路径限速
+        self.rate_limiter = rate_limiter
+        self.session = session
+
+    def _get_session(self):
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=60)
+            # trust_env=True: 与 requests 一样读取 HTTP(S)_PROXY 环境变量
+            self.session = aiohttp.ClientSession(connector=connector, timeout=self.timeout, trust_env=True)
+        return self.session
+
+    async def _send(self, method, url, body, header):
+        session = self._get_session()
+        attempt = 0
+        while True:
+            try:
+                async with session.request(method, url, data=body or None, headers=header) as response:
+                    result = _AsyncResponse(response.status, await response.text(), response.headers)
+                # 与同步客户端的重试策略一致: 仅幂等方法按状态码重试
+                if (result.status_code in c.HTTP_RETRY_STATUS and method != c.POST
+                        and attempt < self.max_retries):
+                    attempt += 1
+                    await asyncio.sleep(c.HTTP_BACKOFF_FACTOR * (2 ** (attempt - 1)))
+                    continue
+                return result
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                if method == c.POST or attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                await asyncio.sleep(c.HTTP_BACKOFF_FACTOR * (2 ** (attempt - 1)))
+
+    async def _request(self, method, request_path, params, cursor=False):
+        # 先限流再取时间戳, 排队等待不会让签名时间过期
+        endpoint = c.RATE_LIMIT_PREFIX + request_path
+        if self.rate_limiter is not None:
+            await self.rate_limiter.acquire_async(endpoint)
+
+        # 获取本地时间
+        timestamp = utils.get_timestamp()
+
+        # sign & header
+        if self.use_server_time:
+            # 获取服务器时间接口
+            timestamp = await self._get_timestamp()
+
+        request_path, body, header = utils.build_request(
+            self.API_KEY, self.API_SECRET_KEY, self.PASSPHRASE, method, request_path, params, timestamp)
+        # url
+        url = c.API_URL + request_path
+
+        if self.first:
+            logger.debug("first request url: %s method: %s body: %s headers: %s",
+                         url, method, body, redact_header(header))
+            self.first = False
+
+        # send request
+        response = await self._send(method, url, body, header)
+
+        if debug_sampled(logger):
+            logger.debug("%s %s -> %s %s", method, request_path, response.status_code, response.text)
+        if self.rate_limiter is not None:
+            if response.status_code == 429:
+                retry_after = response.headers.get('Retry-After')
+                self.rate_limiter.on_rate_limited(endpoint, float(retry_after) if retry_after else None)
+            else:
+                self.rate_limiter.on_success(endpoint)
+        # exception handle
+        if not str(response.status_code).startswith('2'):
+            raise exceptions.BitgetAPIException(response)
+        try:
+            if cursor:
+                r = dict()
+                try:
+                    r['before'] = response.headers['OK-BEFORE']
+                    r['after'] = response.headers['OK-AFTER']
+                except:
+                    pass
+                return response.json(), r
+            else:
+                return response.json()
+
+        except ValueError:
+            raise exceptions.BitgetRequestException('Invalid Response: %s' % response.text)
+
+    async def _request_without_params(self, method, request_path):
+        return await self._request(method, request_path, {})
+
+    async def _request_with_params(self, method, request_path, params, cursor=False):
+        return await self._request(method, request_path, params, cursor)
+
+    async def _get_timestamp(self):
+        url = c.API_URL + c.SERVER_TIMESTAMP_URL
+        response = await self._send(c.GET, url, "", {})
+        if response.status_code == 200:
+            return response.json()['timestamp']
+        else:
+            return ""
+
+    async def close(self):
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
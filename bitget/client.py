@@ -1,23 +1,56 @@
 import requests
-import json
+import logging
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from . import consts as c, utils, exceptions
+from .log import debug_sampled, redact_header
+
+logger = logging.getLogger(__name__)
+
+
+def build_session(pool_size=c.HTTP_POOL_SIZE, max_retries=c.HTTP_MAX_RETRIES, backoff_factor=c.HTTP_BACKOFF_FACTOR):
+    # keep-alive 连接池: 同一个 session 复用 TCP/TLS 连接
+    # 只对幂等方法 (GET/DELETE) 按状态码重试, POST 仅在连接建立失败时重试
+    retry = Retry(
+        total=max_retries,
+        connect=max_retries,
+        read=max_retries,
+        status=max_retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=c.HTTP_RETRY_STATUS,
+        allowed_methods=frozenset([c.GET, c.DELETE]),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
 
 
 class Client(object):
 
-    def __init__(self, api_key, api_secret_key, passphrase, use_server_time=False, first=False):
+    def __init__(self, api_key, api_secret_key, passphrase, use_server_time=False, first=False,
+                 session=None, pool_size=c.HTTP_POOL_SIZE, timeout=None, max_retries=c.HTTP_MAX_RETRIES,
+                 rate_limiter=None):
 
         self.API_KEY = api_key
         self.API_SECRET_KEY = api_secret_key
         self.PASSPHRASE = passphrase
         self.use_server_time = use_server_time
         self.first = first
+        # 传入已有的 session 即可让多个 *Api 实例共享同一个连接池
+        # 可选的限流器 (acquire / on_rate_limited / on_success), 按接口路径限速
+        self.rate_limiter = rate_limiter
+        self.session = session if session is not None else build_session(pool_size, max_retries)
+        self.timeout = timeout if timeout is not None else (c.HTTP_CONNECT_TIMEOUT, c.HTTP_READ_TIMEOUT)
 
     def _request(self, method, request_path, params, cursor=False):
-        if method == c.GET:
-            request_path = request_path + utils.parse_params_to_str(params)
-        # url
-        url = c.API_URL + request_path
+        # 先限流再取时间戳, 排队等待不会让签名时间过期
+        endpoint = c.RATE_LIMIT_PREFIX + request_path
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire(endpoint)
 
         # 获取本地时间
         timestamp = utils.get_timestamp()
@@ -27,18 +60,14 @@ class Client(object):
             # 获取服务器时间接口
             timestamp = self._get_timestamp()
 
-        body = json.dumps(params) if method == c.POST else ""
-        sign = utils.sign(utils.pre_hash(timestamp, method, request_path, str(body)), self.API_SECRET_KEY)
-        if c.SIGN_TYPE == c.RSA:
-            sign = utils.signByRSA(utils.pre_hash(timestamp, method, request_path, str(body)), self.API_SECRET_KEY)
-        header = utils.get_header(self.API_KEY, sign, timestamp, self.PASSPHRASE)
+        request_path, body, header = utils.build_request(
+            self.API_KEY, self.API_SECRET_KEY, self.PASSPHRASE, method, request_path, params, timestamp)
+        # url
+        url = c.API_URL + request_path
 
         if self.first:
-            print("url:", url)
-            print("method:", method)
-            print("body:", body)
-            print("headers:", header)
-            # print("sign:", sign)
+            logger.debug("first request url: %s method: %s body: %s headers: %s",
+                         url, method, body, redact_header(header))
             self.first = False
 
 
@@ -47,16 +76,21 @@ class Client(object):
         # send request
         response = None
         if method == c.GET:
-            response = requests.get(url, headers=header)
-            print("response : ",response.text)
+            response = self.session.get(url, headers=header, timeout=self.timeout)
         elif method == c.POST:
-            response = requests.post(url, data=body, headers=header)
-            print("response : ",response.text)
+            response = self.session.post(url, data=body, headers=header, timeout=self.timeout)
             #response = requests.post(url, json=body, headers=header)
         elif method == c.DELETE:
-            response = requests.delete(url, headers=header)
-
-        print("status:", response.status_code)
+            response = self.session.delete(url, headers=header, timeout=self.timeout)
+
+        if debug_sampled(logger):
+            logger.debug("%s %s -> %s %s", method, request_path, response.status_code, response.text)
+        if self.rate_limiter is not None:
+            if response.status_code == 429:
+                retry_after = response.headers.get('Retry-After')
+                self.rate_limiter.on_rate_limited(endpoint, float(retry_after) if retry_after else None)
+            else:
+                self.rate_limiter.on_success(endpoint)
         # exception handle
         if not str(response.status_code).startswith('2'):
             raise exceptions.BitgetAPIException(response)
@@ -84,8 +118,11 @@ class Client(object):
 
     def _get_timestamp(self):
         url = c.API_URL + c.SERVER_TIMESTAMP_URL
-        response = requests.get(url)
+        response = self.session.get(url, timeout=self.timeout)
         if response.status_code == 200:
             return response.json()['timestamp']
         else:
             return ""
+
+    def close(self):
+        self.session.close()
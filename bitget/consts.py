@@ -1,6 +1,9 @@
 # Base Url
 API_URL = 'https://api.bitget.com'
+# v1 合约 WS (旧版), 新代码请使用 V2_WS_*
 CONTRACT_WS_URL = 'wss://ws.bitget.com/mix/v1/stream'
+V2_WS_PUBLIC_URL = 'wss://ws.bitget.com/v2/ws/public'
+V2_WS_PRIVATE_URL = 'wss://ws.bitget.com/v2/ws/private'
 
 # http header
 CONTENT_TYPE = 'Content-Type'
@@ -23,5 +26,18 @@ RSA = "RSA"
 SHA256 = "SHA256"
 SIGN_TYPE = SHA256
 
+# http session
+HTTP_POOL_SIZE = 10
+HTTP_CONNECT_TIMEOUT = 3.05
+HTTP_READ_TIMEOUT = 10
+HTTP_MAX_RETRIES = 3
+HTTP_BACKOFF_FACTOR = 0.5
+# 429 不在传输层重试: 交给限流器按 Retry-After 退避 (rate_limiter.RateLimiter.on_rate_limited)
+HTTP_RETRY_STATUS = (500, 502, 503, 504)
+RATE_LIMIT_PREFIX = 'bitget:'
+
 # ws
 REQUEST_PATH = '/user/verify'
+WS_PING_INTERVAL = 25
+WS_RECONNECT_BASE_DELAY = 1
+WS_RECONNECT_MAX_DELAY = 60
@@ -0,0 +1,23 @@
+import logging
+import random
+
+# SDK 统一的日志根节点, 各模块使用 logging.getLogger(__name__) 挂在其下
+logger = logging.getLogger("bitget")
+
+_debug_sample_rate = 1.0
+
+
+def set_debug_sample_rate(rate):
+    # 采样调试: 只记录一部分请求/消息的 DEBUG 详情, 避免高频路径刷屏
+    global _debug_sample_rate
+    _debug_sample_rate = max(0.0, min(1.0, float(rate)))
+
+
+def debug_sampled(log):
+    if not log.isEnabledFor(logging.DEBUG):
+        return False
+    return _debug_sample_rate >= 1.0 or random.random() < _debug_sample_rate
+
+
+def redact_header(header):
+    return {k: ('***' if k in ('ACCESS-SIGN', 'ACCESS-PASSPHRASE') else v) for k, v in header.items()}
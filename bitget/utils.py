@@ -1,11 +1,8 @@
 import base64
 import hmac
+import json
 import time
 
-from Crypto.Hash import SHA256
-from Crypto.PublicKey import RSA
-from Crypto.Signature import PKCS1_v1_5 as pk
-
 from . import consts as c
 
 
@@ -15,6 +12,11 @@ def sign(message, secret_key):
     return str(base64.b64encode(d), 'utf8')
 
 def signByRSA(message, secret_key):
+    # 只有 SIGN_TYPE 为 RSA 时才需要 PyCryptodome, 按需导入
+    from Crypto.Hash import SHA256
+    from Crypto.PublicKey import RSA
+    from Crypto.Signature import PKCS1_v1_5 as pk
+
     privatekey = RSA.importKey(secret_key)
     h = SHA256.new(message.encode('utf-8'))
     signer = pk.new(privatekey)
@@ -38,6 +40,19 @@ def get_header(api_key, sign, timestamp, passphrase):
     return header
 
 
+def build_request(api_key, secret_key, passphrase, method, request_path, params, timestamp):
+    # 同步/异步客户端共用的签名逻辑, 返回 (request_path, body, header)
+    if method == c.GET:
+        request_path = request_path + parse_params_to_str(params)
+    body = json.dumps(params) if method == c.POST else ""
+    message = pre_hash(timestamp, method, request_path, str(body))
+    if c.SIGN_TYPE == c.RSA:
+        sign_str = signByRSA(message, secret_key)
+    else:
+        sign_str = sign(message, secret_key)
+    return request_path, body, get_header(api_key, sign_str, timestamp, passphrase)
+
+
 def parse_params_to_str(params):
     params = [(key, val) for key, val in params.items()]
     params.sort(key=lambda x: x[0])
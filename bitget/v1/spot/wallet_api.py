@@ -4,8 +4,8 @@ from bitget.consts import GET, POST
 
 
 class WalletApi(Client):
-    def __init__(self, api_key, api_secret_key, passphrase, use_server_time=False, first=False):
-        Client.__init__(self, api_key, api_secret_key, passphrase, use_server_time, first)
+    def __init__(self, api_key, api_secret_key, passphrase, use_server_time=False, first=False, **kwargs):
+        Client.__init__(self, api_key, api_secret_key, passphrase, use_server_time, first, **kwargs)
 
     def transfer(self, params):
         return self._request_with_params(POST, '/api/spot/v1/wallet/transfer', params)
@@ -4,8 +4,8 @@ from bitget.consts import GET
 
 
 class MarketApi(Client):
-    def __init__(self, api_key, api_secret_key, passphrase, use_server_time=False, first=False):
-        Client.__init__(self, api_key, api_secret_key, passphrase, use_server_time, first)
+    def __init__(self, api_key, api_secret_key, passphrase, use_server_time=False, first=False, **kwargs):
+        Client.__init__(self, api_key, api_secret_key, passphrase, use_server_time, first, **kwargs)
 
     def coins(self, params):
         return self._request_with_params(GET, '/api/v2/spot/market/coins', params)
@@ -1,16 +1,25 @@
 #!/usr/bin/python
 import json
-import math
+import logging
+import random
 import threading
 import time
-import traceback
-from threading import Timer
-from zlib import crc32
 
 import websocket
 
+# 可选的快速 JSON 解码器, 未安装时退回标准库
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
 from bitget.consts import GET
-from .. import consts as c, utils
+from .. import consts as c, utils, exceptions
+from .order_book import OrderBook
+from ..log import debug_sampled
+
+logger = logging.getLogger(__name__)
 
 WS_OP_LOGIN = 'login'
 WS_OP_SUBSCRIBE = "subscribe"
@@ -18,11 +27,17 @@ WS_OP_UNSUBSCRIBE = "unsubscribe"
 
 
 def handle(message):
-    print("default:" + message)
+    if debug_sampled(logger):
+        logger.debug("default: %s", message)
 
 
 def handel_error(message):
-    print("default_error:" + message)
+    logger.error("default_error: %s", message)
+
+
+def channel_key(arg):
+    # 推送里的 arg 直接转成元组作为分发键, 不再构造对象或二次解析
+    return arg.get('instType'), arg.get('channel'), arg.get('instId', arg.get('coin'))
 
 
 class BitgetWsClient:
@@ -32,7 +47,6 @@ class BitgetWsClient:
         self.__need_login = need_login
         self.__connection = False
         self.__login_status = False
-        self.__reconnect_status = False
         self.__api_key = None
         self.__api_secret_key = None
         self.__passphrase = None
@@ -42,20 +56,38 @@ class BitgetWsClient:
         self.__url = url
         self.__scribe_map = {}
         self.__allbooks_map = {}
-
-    def build(self):
-        self.__ws_client = self.__init_client()
-        __thread = threading.Thread(target=self.connect)
-        __thread.start()
-
-        while not self.has_connect():
-            print("start connecting... url: ", self.__url)
-            time.sleep(1)
-
-        if self.__need_login:
-            self.__login()
-
-        self.__keep_connected(25)
+        self.__ws_client = None
+        self.__send_lock = threading.Lock()
+        # 连接就绪 (已连接, 需要登录时已登录) 后置位, 断开时清除
+        self.__ready = threading.Event()
+        self.__stopped = threading.Event()
+        # 登录被拒绝时的错误消息 (密钥错误等重连也无法恢复), build 据此直接失败
+        self.__login_error = None
+        self.__last_recv = time.monotonic()
+        self.__supervisor = None
+        self.__heartbeat = None
+
+    def build(self, timeout=None):
+        # 只启动一个监督线程负责连接/重连, 以及一个心跳线程; 重复调用不会再创建
+        # timeout 秒内未就绪或登录被拒绝时关闭连接并抛出异常, 为 None 时一直等待
+        if self.__supervisor is None:
+            self.__supervisor = threading.Thread(target=self.__supervise, name="bitget-ws", daemon=True)
+            self.__supervisor.start()
+            self.__heartbeat = threading.Thread(target=self.__keep_connected, args=(c.WS_PING_INTERVAL,),
+                                                name="bitget-ws-heartbeat", daemon=True)
+            self.__heartbeat.start()
+
+        self.__login_error = None
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self.__ready.wait(1):
+            if self.__login_error is not None:
+                error = self.__login_error
+                self.close()
+                raise exceptions.BitgetRequestException('websocket login failed: %s' % error)
+            if deadline is not None and time.monotonic() >= deadline:
+                self.close()
+                raise exceptions.BitgetRequestException('websocket not ready after %ss: %s' % (timeout, self.__url))
+            logger.info("start connecting... url: %s", self.__url)
 
         return self
 
@@ -82,16 +114,40 @@ class BitgetWsClient:
     def has_connect(self):
         return self.__connection
 
-    def __init_client(self):
-        try:
-            return websocket.WebSocketApp(self.__url,
-                                          on_open=self.__on_open,
-                                          on_message=self.__on_message,
-                                          on_error=self.__on_error,
-                                          on_close=self.__on_close)
+    def close(self):
+        self.__stopped.set()
+        self.__ready.clear()
+        if self.__ws_client:
+            self.__ws_client.close()
 
-        except Exception as ex:
-            print(ex)
+    def __init_client(self):
+        return websocket.WebSocketApp(self.__url,
+                                      on_open=self.__on_open,
+                                      on_message=self.__on_message,
+                                      on_error=self.__on_error,
+                                      on_close=self.__on_close)
+
+    def __supervise(self):
+        # 单线程循环: run_forever 返回即视为断线, 按指数退避 + 抖动重连
+        attempt = 0
+        while not self.__stopped.is_set():
+            started = time.monotonic()
+            try:
+                self.__ws_client = self.__init_client()
+                self.__ws_client.run_forever()
+            except Exception:
+                logger.exception("websocket run_forever failed")
+            self.__close()
+            if self.__stopped.is_set():
+                break
+            # 连接稳定运行过一段时间则重置退避
+            if time.monotonic() - started > c.WS_RECONNECT_MAX_DELAY:
+                attempt = 0
+            delay = min(c.WS_RECONNECT_MAX_DELAY, c.WS_RECONNECT_BASE_DELAY * (2 ** attempt))
+            delay = delay * random.uniform(0.5, 1.0)
+            attempt += 1
+            logger.warning("start reconnection in %.1fs ...", delay)
+            self.__stopped.wait(delay)
 
     def __login(self):
         utils.check_none(self.__api_key, "api key")
@@ -103,74 +159,90 @@ class BitgetWsClient:
             sign = utils.signByRSA(utils.pre_hash(timestamp, GET, c.REQUEST_PATH), self.__api_secret_key)
         ws_login_req = WsLoginReq(self.__api_key, self.__passphrase, str(timestamp), sign)
         self.send_message(WS_OP_LOGIN, [ws_login_req])
-        print("logging in......")
-        while not self.__login_status:
-            time.sleep(1)
-
-    def connect(self):
-        try:
-            self.__ws_client.run_forever(ping_timeout=10)
-        except Exception as ex:
-            print(ex)
+        logger.info("logging in......")
 
     def __keep_connected(self, interval):
-        try:
-            __timer_thread = Timer(interval, self.__keep_connected, (interval,))
-            __timer_thread.start()
-            self.__ws_client.send("ping")
-        except Exception as ex:
-            print(ex)
+        # 全局唯一的心跳调度: 定时发 ping, 长时间收不到任何消息则主动断开触发重连
+        while not self.__stopped.wait(interval):
+            if not self.__connection:
+                continue
+            try:
+                if time.monotonic() - self.__last_recv > interval * 2:
+                    logger.warning("heartbeat timeout, reconnecting...")
+                    self.__ws_client.close()
+                    continue
+                self.__send("ping")
+            except Exception:
+                logger.exception("heartbeat failed")
+
+    def __send(self, message):
+        with self.__send_lock:
+            self.__ws_client.send(message)
 
     def send_message(self, op, args):
-        message = json.dumps(BaseWsReq(op, args), default=lambda o: o.__dict__)
-        print("send message:" + message)
-        self.__ws_client.send(message)
+        message = json.dumps(BaseWsReq(op, args), default=lambda o: o.to_dict() if hasattr(o, 'to_dict') else o.__dict__)
+        if debug_sampled(logger):
+            logger.debug("send message: %s", message)
+        self.__send(message)
 
     def subscribe(self, channels, listener=None):
 
         if listener:
             for chanel in channels:
                 chanel.inst_type = str(chanel.inst_type)
-                self.__scribe_map[chanel] = listener
+                self.__scribe_map[chanel.key()] = listener
 
         for channel in channels:
             self.__all_suribe.add(channel)
 
-        self.send_message(WS_OP_SUBSCRIBE, channels)
+        # 未就绪时只登记, 连接 (登录) 成功后统一补订阅
+        if self.__ready.is_set():
+            self.send_message(WS_OP_SUBSCRIBE, channels)
 
     def unsubscribe(self, channels):
         try:
-            for chanel in channels:
-                if chanel in self.__scribe_map:
-                    del self.__scribe_map[chanel]
-
             for channel in channels:
-                if chanel in self.__all_suribe:
-                    self.__all_suribe.remove(channel)
+                self.__scribe_map.pop(channel.key(), None)
+                self.__all_suribe.discard(channel)
 
-            self.send_message(WS_OP_UNSUBSCRIBE, channels)
+            if self.__ready.is_set():
+                self.send_message(WS_OP_UNSUBSCRIBE, channels)
         except Exception as e:
             pass
 
+    def __resubscribe(self):
+        # 重连后把所有频道合并成一个 subscribe 帧发送
+        self.__ready.set()
+        if self.__all_suribe:
+            self.send_message(WS_OP_SUBSCRIBE, list(self.__all_suribe))
+
     def __on_open(self, ws):
-        print('connection is success....')
+        logger.info('connection is success....')
         self.__connection = True
-        self.__reconnect_status = False
+        self.__last_recv = time.monotonic()
+        if self.__need_login:
+            self.__login()
+        else:
+            self.__resubscribe()
 
     def __on_message(self, ws, message):
+        self.__last_recv = time.monotonic()
 
         if message == 'pong':
-            print("Keep connected:" + message)
             return
-        json_obj = json.loads(message)
-        if "code" in json_obj and json_obj.get("code") != 0:
+        # 每帧只解析一次, 监听器直接收到解析后的对象
+        json_obj = _loads(message)
+        if "code" in json_obj and str(json_obj.get("code")) != "0":
+            if self.__need_login and not self.__login_status:
+                self.__login_error = json_obj
             if self.__error_listener:
-                self.__error_listener(message)
+                self.__error_listener(json_obj)
                 return
 
         if "event" in json_obj and json_obj.get("event") == "login":
-            print("login msg:" + message)
+            logger.info("login msg: %s", message)
             self.__login_status = True
+            self.__resubscribe()
             return
         listenner = None
         if "data" in json_obj:
@@ -180,13 +252,10 @@ class BitgetWsClient:
             listenner = self.get_listener(json_obj)
 
         if listenner:
-            listenner(message)
+            listenner(json_obj)
             return
 
-        self.__listener(message)
-
-    def __dict_books_info(self, dict):
-        return BooksInfo(dict['asks'], dict['bids'], dict['checksum'])
+        self.__listener(json_obj)
 
     def __dict_to_subscribe_req(self, dict):
         if "instId" in dict:
@@ -196,131 +265,61 @@ class BitgetWsClient:
         return SubscribeReq(dict['instType'], dict['channel'], instId)
 
     def get_listener(self, json_obj):
-        try:
-            if json_obj.get('arg'):
-                json_str = str(json_obj.get('arg')).replace("\'", "\"")
-                subscribe_req = json.loads(json_str, object_hook=self.__dict_to_subscribe_req)
-                return self.__scribe_map.get(subscribe_req)
-        except Exception as e:
-            print(json_obj.get('arg'), e)
-            pass
+        arg = json_obj.get('arg')
+        if arg:
+            return self.__scribe_map.get(channel_key(arg))
 
     def __on_error(self, ws, msg):
-        print("error:", msg)
-        self.__close()
-        if not self.__reconnect_status:
-            self.__re_connect()
+        logger.warning("error: %s", msg)
 
     def __on_close(self, ws, close_status_code, close_msg):
-        print("ws is closeing ......close_status:{},close_msg:{}".format(close_status_code, close_msg))
-        self.__close()
-        if not self.__reconnect_status:
-            self.__re_connect()
-
-    def __re_connect(self):
-        # 重连
-        self.__reconnect_status = True
-        print("start reconnection ...")
-        self.build()
-        for channel in self.__all_suribe :
-            self.subscribe([channel])
-        pass
+        logger.warning("ws is closeing ......close_status:%s,close_msg:%s", close_status_code, close_msg)
 
     def __close(self):
+        self.__ready.clear()
         self.__login_status = False
         self.__connection = False
-        self.__ws_client.close()
+
+    def get_order_book(self, subscribe_req):
+        return self.__allbooks_map.get(subscribe_req.key())
 
     def __check_sum(self, json_obj):
         # noinspection PyBroadException
         try:
             if "arg" not in json_obj or "action" not in json_obj:
                 return True
-            arg = str(json_obj.get('arg')).replace("\'", "\"")
-            action = str(json_obj.get('action')).replace("\'", "\"")
-            data = str(json_obj.get('data')).replace("\'", "\"")
-
-            subscribe_req = json.loads(arg, object_hook=self.__dict_to_subscribe_req)
-
-            if subscribe_req.channel != "books":
+            arg = json_obj['arg']
+            if arg.get('channel') != "books":
                 return True
 
-            books_info = json.loads(data, object_hook=self.__dict_books_info)[0]
+            book_key = channel_key(arg)
+            action = json_obj['action']
+            books = json_obj['data'][0]
 
             if action == "snapshot":
-                self.__allbooks_map[subscribe_req] = books_info
+                order_book = OrderBook()
+                order_book.snapshot(books.get('asks', []), books.get('bids', []))
+                self.__allbooks_map[book_key] = order_book
                 return True
             if action == "update":
-                all_books = self.__allbooks_map[subscribe_req]
-                if all_books is None:
+                order_book = self.__allbooks_map.get(book_key)
+                if order_book is None:
                     return False
 
-                all_books = all_books.merge(books_info)
-                check_sum = all_books.check_sum(books_info.checksum)
-                if not check_sum:
-                    self.unsubscribe([subscribe_req])
-                    self.subscribe([subscribe_req])
+                order_book.update(books.get('asks', []), books.get('bids', []))
+                if not order_book.verify(books['checksum']):
+                    # 本地盘口已不可信, 丢弃并重新订阅拿快照
+                    del self.__allbooks_map[book_key]
+                    subscribe_req = self.__dict_to_subscribe_req(arg)
+                    self.send_message(WS_OP_UNSUBSCRIBE, [subscribe_req])
+                    self.send_message(WS_OP_SUBSCRIBE, [subscribe_req])
                     return False
-                self.__allbooks_map[subscribe_req] = all_books
-        except Exception as e:
-            msg = traceback.format_exc()
-            print(msg)
+        except Exception:
+            logger.exception("order book checksum failed")
 
         return True
 
 
-class BooksInfo:
-    def __init__(self, asks, bids, checksum):
-        self.asks = asks
-        self.bids = bids
-        self.checksum = checksum
-
-    def merge(self, book_info):
-        self.asks = self.innerMerge(self.asks, book_info.asks, False)
-        self.bids = self.innerMerge(self.bids, book_info.bids, True)
-        return self
-
-    def innerMerge(self, all_list, update_list, is_reverse):
-        price_and_value = {}
-        for v in all_list:
-            price_and_value[v[0]] = v
-
-        for v in update_list:
-            if v[1] == "0":
-                del price_and_value[v[0]]
-                continue
-            price_and_value[v[0]] = v
-
-        keys = sorted(price_and_value.keys(), reverse=is_reverse)
-
-        result = []
-
-        for i in keys:
-            result.append(price_and_value[i])
-
-        return result
-
-    def check_sum(self, new_check_sum):
-        crc32str = ''
-        for x in range(25):
-            if self.bids[x] is not None:
-                crc32str = crc32str + self.bids[x][0] + ":" + self.bids[x][1] + ":"
-
-            if self.asks[x] is not None:
-                crc32str = crc32str + self.asks[x][0] + ":" + self.asks[x][1] + ":"
-
-        crc32str = crc32str[0:len(crc32str) - 1]
-        print(crc32str)
-        merge_num = crc32(bytes(crc32str, encoding="utf8"))
-        print("start checknum mergeVal:" + str(merge_num) + ",checkVal:" + str(new_check_sum)+",checkSin:"+str(self.__signed_int(merge_num)))
-        return self.__signed_int(merge_num) == new_check_sum
-
-    def __signed_int(self, checknum):
-        int_max = math.pow(2, 31) - 1
-        if checknum > int_max:
-            return checknum - int_max * 2 - 2
-        return checknum
-
 class SubscribeReq:
 
     def __init__(self, inst_type, channel, instId):
@@ -335,6 +334,13 @@ class SubscribeReq:
     def __hash__(self) -> int:
         return hash(self.inst_type + self.channel + self.inst_id)
 
+    def key(self):
+        return str(self.inst_type), self.channel, self.inst_id
+
+    def to_dict(self):
+        # 按交易所协议的字段名序列化 (instType / channel / instId)
+        return {"instType": self.inst_type, "channel": self.channel, "instId": self.inst_id}
+
 
 class BaseWsReq:
 
@@ -350,3 +356,6 @@ class WsLoginReq:
         self.passphrase = passphrase
         self.timestamp = timestamp
         self.sign = sign
+
+    def to_dict(self):
+        return {"apiKey": self.api_key, "passphrase": self.passphrase, "timestamp": self.timestamp, "sign": self.sign}
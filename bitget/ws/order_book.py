@@ -0,0 +1,83 @@
+#!/usr/bin/python
+from bisect import bisect_left, insort
+from zlib import crc32
+
+CHECKSUM_DEPTH = 25
+
+
+class BookSide:
+    # 一侧盘口: 有序价格键 + 价格 -> 档位字典
+    # 增量更新只触及变化的档位 (二分定位), 不再整本重建和重新排序
+    # 取舍: 二分查找是 O(log n), 但 insort / del 在 list 上要搬移元素, 单档更新是 O(n);
+    # 盘口只有几百档且变化集中在盘口附近, 连续内存的 memmove 比平衡树 / SortedList
+    # 的常数更小, 也不引入额外依赖; 全量快照用 load() 一次排序, 不逐档 insort
+
+    def __init__(self, descending):
+        self.descending = descending
+        self._keys = []
+        self._levels = {}
+
+    def clear(self):
+        self._keys = []
+        self._levels = {}
+
+    def load(self, levels):
+        # 全量快照: 直接建表后排序一次, O(n log n)
+        self._levels = {}
+        for level in levels:
+            price, size = level[0], level[1]
+            if float(size) != 0:
+                self._levels[-float(price) if self.descending else float(price)] = (price, size)
+        self._keys = sorted(self._levels)
+
+    def apply(self, levels):
+        for level in levels:
+            price, size = level[0], level[1]
+            # 买盘按价格降序, 用负数键保持列表升序
+            key = -float(price) if self.descending else float(price)
+            if float(size) == 0:
+                if self._levels.pop(key, None) is not None:
+                    del self._keys[bisect_left(self._keys, key)]
+                continue
+            if key not in self._levels:
+                insort(self._keys, key)
+            # 保留交易所原始字符串, 校验和必须使用原始精度
+            self._levels[key] = (price, size)
+
+    def top(self, depth):
+        return [self._levels[key] for key in self._keys[:depth]]
+
+    def __len__(self):
+        return len(self._keys)
+
+
+class OrderBook:
+
+    def __init__(self):
+        self.asks = BookSide(descending=False)
+        self.bids = BookSide(descending=True)
+
+    def snapshot(self, asks, bids):
+        self.asks.load(asks)
+        self.bids.load(bids)
+
+    def update(self, asks, bids):
+        self.asks.apply(asks)
+        self.bids.apply(bids)
+
+    def checksum(self, depth=CHECKSUM_DEPTH):
+        # 交易所规则: bid1:size1:ask1:size1:bid2:... 交替拼接前 25 档, 缺档跳过
+        bids = self.bids.top(depth)
+        asks = self.asks.top(depth)
+        parts = []
+        for i in range(max(len(bids), len(asks))):
+            if i < len(bids):
+                parts.extend(bids[i])
+            if i < len(asks):
+                parts.extend(asks[i])
+        value = crc32(":".join(parts).encode("utf8"))
+        # 交易所下发的是有符号 32 位整数
+        return value - (1 << 32) if value >= (1 << 31) else value
+
+    def verify(self, checksum, depth=CHECKSUM_DEPTH):
+        return self.checksum(depth) == int(checksum)
@@ -2,6 +2,9 @@
 # 负责与 Bitget 交易所 API 交互
 
 import os
+import asyncio
+import threading
+import aiohttp
 from dotenv import load_dotenv
 
 # Step 1.1: 加载环境变量
@@ -11,50 +14,421 @@ API_KEY = os.getenv("BITGET_API_KEY")
 SECRET_KEY = os.getenv("BITGET_SECRET_KEY")
 PASSPHRASE = os.getenv("BITGET_PASSPHRASE")
 
+# HTTP 连接池配置 (keep-alive, 避免每次轮询都重新握手)
+POOL_SIZE = int(os.getenv("BITGET_POOL_SIZE", 10))
+CONNECT_TIMEOUT = float(os.getenv("BITGET_CONNECT_TIMEOUT", 3.05))
+READ_TIMEOUT = float(os.getenv("BITGET_READ_TIMEOUT", 10))
+MAX_RETRIES = int(os.getenv("BITGET_MAX_RETRIES", 3))
+
+# 同步的合约类型 (逗号分隔): USDT-FUTURES / COIN-FUTURES / USDC-FUTURES
+DEFAULT_PRODUCT_TYPE = "USDT-FUTURES"
+PRODUCT_TYPES = [t.strip().upper() for t in os.getenv("PRODUCT_TYPES", DEFAULT_PRODUCT_TYPE).split(",") if t.strip()]
+
+# 历史仓位分页: 单页上限 100 条; 追赶模式最多向前翻的页数
+HISTORY_PAGE_LIMIT = 100
+HISTORY_MAX_PAGES = int(os.getenv("HISTORY_MAX_PAGES", 50))
+# 成交明细分页: 单页上限 100 条; 单次查询的时间窗口不超过 7 天
+FILL_PAGE_LIMIT = 100
+FILL_WINDOW_MS = 7 * 86400 * 1000
+
 # Step 1.2: 初始化 Bitget 客户端
 from bitget.bitget_api import BitgetApi
+from bitget.client import build_session
+from bitget.async_bitget_api import AsyncBitgetApi
+from bitget.v2.mix.order_api import OrderApi
+from bitget.v2.mix.market_api import MarketApi
+from rate_limiter import limiter
+
+# 所有账户的同步客户端共享同一个 requests 连接池
+session = build_session(POOL_SIZE, MAX_RETRIES)
+# 进程内常驻的事件循环, 保证 aiohttp 连接池跨周期复用
+_loop = asyncio.new_event_loop()
+# ws 多账户模式下多个线程都可能驱动这个事件循环, 同一时刻只允许一个
+_loop_lock = threading.Lock()
+# 所有账户的异步客户端共享的 aiohttp 会话 (必须在事件循环内创建)
+_aio_session = None
+
 
-client = BitgetApi(API_KEY, SECRET_KEY, PASSPHRASE)
+async def _shared_aio_session():
+    global _aio_session
+    if _aio_session is None or _aio_session.closed:
+        connector = aiohttp.TCPConnector(limit=POOL_SIZE, keepalive_timeout=60)
+        timeout = aiohttp.ClientTimeout(sock_connect=CONNECT_TIMEOUT, sock_read=READ_TIMEOUT)
+        _aio_session = aiohttp.ClientSession(connector=connector, timeout=timeout, trust_env=True)
+    return _aio_session
 
 
-def get_positions():
+def _parse_positions(response):
+    if response.get("code") == "00000":
+        return response.get("data", [])
+    else:
+        print(f"[Bitget] 获取持仓失败: {response.get('msg')}")
+        return []
+
+
+def _parse_history(response):
+    if response.get("code") == "00000":
+        return response.get("data", {}).get("list", [])
+    else:
+        print(f"[Bitget] 获取历史仓位失败: {response.get('msg')}")
+        return []
+
+
+class HistoryList(list):
     """
-    Step 1.3: 获取当前持仓
-    调用 Bitget V2 API: GET /api/v2/mix/position/all-position
-    返回当前所有未平仓的仓位列表
+    历史仓位列表 (新 -> 旧)
+    resume_id: 翻页达到 HISTORY_MAX_PAGES 仍未取完时，继续向前翻页的 idLessThan；取完为 None
     """
-    try:
-        params = {"productType": "USDT-FUTURES"}
-        response = client.get("/api/v2/mix/position/all-position", params)
-        
-        if response.get("code") == "00000":
-            return response.get("data", [])
-        else:
-            print(f"[Bitget] 获取持仓失败: {response.get('msg')}")
-            return []
-    except Exception as e:
-        print(f"[Bitget] 获取持仓异常: {e}")
-        return []
+    resume_id = None
+
+
+def _history_params(since=None, product_type=DEFAULT_PRODUCT_TYPE, resume_id=None):
+    params = {"productType": product_type}
+    if since:
+        # 增量模式: 只请求高水位之后的仓位
+        params["startTime"] = int(since)
+        params["limit"] = HISTORY_PAGE_LIMIT
+        if resume_id:
+            # 上次翻页被截断: 从截断处继续向前翻
+            params["idLessThan"] = resume_id
+    return params
+
+
+def _fill_windows(start_ms, end_ms, product_type):
+    # 按 7 天切分时间窗口 (新 -> 旧)，每个窗口的首页请求参数
+    window_end = int(end_ms)
+    while window_end >= start_ms:
+        window_start = max(int(start_ms), window_end - FILL_WINDOW_MS + 1)
+        yield {"productType": product_type, "startTime": window_start,
+               "endTime": window_end, "limit": FILL_PAGE_LIMIT}
+        window_end = window_start - 1
 
 
-def get_history_positions():
+def _next_fill_params(params, response):
     """
-    Step 1.4: 获取历史仓位
-    调用 Bitget V2 API: GET /api/v2/mix/position/history-position
-    返回已平仓的仓位历史记录
+    成交明细的翻页: 返回 (本页成交, 下一页参数)，本窗口已取完时下一页参数为 None；
+    请求失败时返回 (None, None)
     """
-    try:
-        params = {"productType": "USDT-FUTURES"}
-        response = client.get("/api/v2/mix/position/history-position", params)
-        
-        if response.get("code") == "00000":
-            return response.get("data", {}).get("list", [])
-        else:
-            print(f"[Bitget] 获取历史仓位失败: {response.get('msg')}")
+    if response.get("code") != "00000":
+        print(f"[Bitget] 获取成交明细失败: {response.get('msg')}")
+        return None, None
+    data = response.get("data") or {}
+    page = data.get("fillList") or []
+    if len(page) < FILL_PAGE_LIMIT or not data.get("endId"):
+        return page, None
+    return page, dict(params, idLessThan=data["endId"])
+
+
+def _parse_mark_prices(response):
+    if response.get("code") != "00000":
+        print(f"[Bitget] 获取行情失败: {response.get('msg')}")
+        return None
+    prices = {}
+    for ticker in response.get("data") or []:
+        price = float(ticker.get("markPrice") or ticker.get("lastPr") or 0)
+        if price > 0:
+            prices[ticker.get("symbol", "")] = price
+    return prices
+
+
+def _merge_marks(results):
+    # 各合约类型的 symbol 互不重复，合并成一张表；全部失败时返回 None
+    marks = {}
+    for prices in results:
+        if prices:
+            marks.update(prices)
+    return marks or None
+
+
+def _failed_history(resume_id=None):
+    # 失败时保留续翻位置，调用方不会误以为已经取完
+    result = HistoryList()
+    result.resume_id = resume_id
+    return result
+
+
+def _next_history_params(params, response, page):
+    """
+    追赶模式的翻页游标: 用上一页的 endId 作为 idLessThan 继续向前翻
+    非增量模式 (since=None) 或已到最后一页时返回 None
+    """
+    if "startTime" not in params or len(page) < HISTORY_PAGE_LIMIT:
+        return None
+    end_id = (response.get("data") or {}).get("endId")
+    if not end_id:
+        return None
+    return dict(params, idLessThan=end_id)
+
+
+class BitgetAccount:
+    """
+    一个 Bitget (子) 账户
+    同步 / 异步客户端共享进程级的连接池; Bitget 按 UID 限频，每个账户使用独立的令牌桶
+    """
+
+    def __init__(self, name: str, api_key: str, secret_key: str, passphrase: str):
+        self.name = name
+        self.api_key = api_key
+        self.secret_key = secret_key
+        self.passphrase = passphrase
+        account_limiter = limiter.scoped(name)
+        self.client = BitgetApi(api_key, secret_key, passphrase,
+                                session=session, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT),
+                                rate_limiter=account_limiter)
+        self.order_api = OrderApi(api_key, secret_key, passphrase,
+                                  session=session, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT),
+                                  rate_limiter=account_limiter)
+        self.market_api = MarketApi(api_key, secret_key, passphrase,
+                                    session=session, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT),
+                                    rate_limiter=account_limiter)
+        # 异步客户端: 同一轮询周期内的多个请求在同一个事件循环上并发执行
+        self.async_client = AsyncBitgetApi(api_key, secret_key, passphrase, pool_size=POOL_SIZE,
+                                           timeout=(CONNECT_TIMEOUT, READ_TIMEOUT), max_retries=MAX_RETRIES,
+                                           rate_limiter=account_limiter)
+
+    def get_positions(self, product_type=DEFAULT_PRODUCT_TYPE):
+        """
+        Step 1.3: 获取当前持仓
+        调用 Bitget V2 API: GET /api/v2/mix/position/all-position
+        返回当前所有未平仓的仓位列表
+        """
+        try:
+            params = {"productType": product_type}
+            response = self.client.get("/api/v2/mix/position/all-position", params)
+            return _parse_positions(response)
+        except Exception as e:
+            print(f"[Bitget] 获取持仓异常: {e}")
             return []
-    except Exception as e:
-        print(f"[Bitget] 获取历史仓位异常: {e}")
-        return []
 
+    def get_history_positions(self, since=None, product_type=DEFAULT_PRODUCT_TYPE, resume_id=None):
+        """
+        Step 1.4: 获取历史仓位
+        调用 Bitget V2 API: GET /api/v2/mix/position/history-position
+        返回已平仓的仓位历史记录 (新 -> 旧)
+        since 为高水位 (毫秒): 为空时只取最新一页; 否则只请求其后的仓位，
+        并用 idLessThan 向前翻页直到补齐缺口 (resume_id 为上次被截断处)。
+        返回 HistoryList: 翻满 HISTORY_MAX_PAGES 页仍未取完时 resume_id 为下次继续的位置；
+        任意一页失败都返回空列表 (resume_id 保持传入值)，避免调用方在不完整的数据上推进高水位
+        """
+        try:
+            params = _history_params(since, product_type, resume_id)
+            result = HistoryList()
+            for _ in range(HISTORY_MAX_PAGES):
+                response = self.client.get("/api/v2/mix/position/history-position", params)
+                if response.get("code") != "00000":
+                    print(f"[Bitget] 获取历史仓位失败: {response.get('msg')}")
+                    return _failed_history(resume_id)
+                page = _parse_history(response)
+                result.extend(page)
+                params = _next_history_params(params, response, page)
+                if params is None:
+                    break
+            result.resume_id = params["idLessThan"] if params is not None else None
+            return result
+        except Exception as e:
+            print(f"[Bitget] 获取历史仓位异常: {e}")
+            return _failed_history(resume_id)
+
+    def get_fills(self, start_ms, end_ms, product_type=DEFAULT_PRODUCT_TYPE):
+        """
+        获取成交明细
+        调用 Bitget V2 API: GET /api/v2/mix/order/fills (OrderApi.fills)
+        按 7 天切分时间窗口，窗口内用 endId 作为 idLessThan 向前翻页
+        返回 [start_ms, end_ms] 内的全部成交 (新 -> 旧)；任意一页失败返回 None，
+        避免调用方在不完整的数据上推进游标
+        """
+        result = []
+        try:
+            for params in _fill_windows(start_ms, end_ms, product_type):
+                while params is not None:
+                    page, params = _next_fill_params(params, self.order_api.fills(params))
+                    if page is None:
+                        return None
+                    result.extend(page)
+            return result
+        except Exception as e:
+            print(f"[Bitget] 获取成交明细异常: {e}")
+            return None
+
+    def get_mark_prices(self, product_type=DEFAULT_PRODUCT_TYPE):
+        """
+        获取该合约类型全部交易对的标记价格
+        调用 Bitget V2 API: GET /api/v2/mix/market/tickers (MarketApi.tickers)，一次请求覆盖所有交易对
+        返回 {symbol: 标记价格}，失败返回 None
+        """
+        try:
+            return _parse_mark_prices(self.market_api.tickers({"productType": product_type}))
+        except Exception as e:
+            print(f"[Bitget] 获取行情异常: {e}")
+            return None
+
+    async def async_get_positions(self, product_type=DEFAULT_PRODUCT_TYPE):
+        """get_positions 的异步版本"""
+        try:
+            params = {"productType": product_type}
+            response = await self.async_client.get("/api/v2/mix/position/all-position", params)
+            return _parse_positions(response)
+        except Exception as e:
+            print(f"[Bitget] 获取持仓异常: {e}")
+            return []
+
+    async def async_get_history_positions(self, since=None, product_type=DEFAULT_PRODUCT_TYPE, resume_id=None):
+        """get_history_positions 的异步版本"""
+        try:
+            params = _history_params(since, product_type, resume_id)
+            result = HistoryList()
+            for _ in range(HISTORY_MAX_PAGES):
+                response = await self.async_client.get("/api/v2/mix/position/history-position", params)
+                if response.get("code") != "00000":
+                    print(f"[Bitget] 获取历史仓位失败: {response.get('msg')}")
+                    return _failed_history(resume_id)
+                page = _parse_history(response)
+                result.extend(page)
+                params = _next_history_params(params, response, page)
+                if params is None:
+                    break
+            result.resume_id = params["idLessThan"] if params is not None else None
+            return result
+        except Exception as e:
+            print(f"[Bitget] 获取历史仓位异常: {e}")
+            return _failed_history(resume_id)
+
+    async def async_get_fills(self, start_ms, end_ms, product_type=DEFAULT_PRODUCT_TYPE):
+        """get_fills 的异步版本"""
+        result = []
+        try:
+            for params in _fill_windows(start_ms, end_ms, product_type):
+                while params is not None:
+                    response = await self.async_client.get("/api/v2/mix/order/fills", params)
+                    page, params = _next_fill_params(params, response)
+                    if page is None:
+                        return None
+                    result.extend(page)
+            return result
+        except Exception as e:
+            print(f"[Bitget] 获取成交明细异常: {e}")
+            return None
+
+    async def async_get_mark_prices(self, product_type=DEFAULT_PRODUCT_TYPE):
+        """get_mark_prices 的异步版本"""
+        try:
+            response = await self.async_client.get("/api/v2/mix/market/tickers", {"productType": product_type})
+            return _parse_mark_prices(response)
+        except Exception as e:
+            print(f"[Bitget] 获取行情异常: {e}")
+            return None
+
+    async def async_fetch_fills(self, windows: dict, end_ms):
+        """并发获取各合约类型的成交明细: {product_type: start_ms} -> {product_type: 成交列表或 None}"""
+        self.async_client.session = await _shared_aio_session()
+        types = list(windows)
+        results = await asyncio.gather(*(self.async_get_fills(windows[t], end_ms, t) for t in types))
+        return dict(zip(types, results))
+
+    async def async_fetch_marks(self):
+        """并发获取所有合约类型的标记价格，合并为 {symbol: 标记价格}，全部失败返回 None"""
+        self.async_client.session = await _shared_aio_session()
+        return _merge_marks(await asyncio.gather(*(self.async_get_mark_prices(t) for t in PRODUCT_TYPES)))
+
+    async def async_fetch_history(self, history_since: dict, resume_ids: dict = None):
+        """
+        并发获取各合约类型的历史仓位: {product_type: since} -> {product_type: HistoryList}
+        resume_ids 为上次被截断的合约类型的续翻位置 {product_type: idLessThan}
+        """
+        self.async_client.session = await _shared_aio_session()
+        resume_ids = resume_ids or {}
+        types = list(history_since)
+        results = await asyncio.gather(*(self.async_get_history_positions(history_since[t], t, resume_ids.get(t))
+                                         for t in types))
+        return dict(zip(types, results))
+
+    async def async_fetch_snapshot(self, history_since: dict, resume_ids: dict = None, with_marks: bool = False):
+        """
+        并发获取所有合约类型的当前持仓与历史仓位 (with_marks 时连同标记价格),
+        耗时约等于最慢的那个请求 (增加合约类型不会线性增加周期耗时)
+        返回 (持仓列表, {product_type: 历史仓位列表}, 标记价格或 None)
+        """
+        self.async_client.session = await _shared_aio_session()
+        positions, history, marks = await asyncio.gather(
+            asyncio.gather(*(self.async_get_positions(t) for t in PRODUCT_TYPES)),
+            self.async_fetch_history(history_since, resume_ids),
+            self.async_fetch_marks() if with_marks else asyncio.sleep(0))
+        return [pos for group in positions for pos in group], history, marks
+
+    def fetch_history(self, history_since: dict, resume_ids: dict = None):
+        """同步入口: 见 async_fetch_history"""
+        with _loop_lock:
+            return _loop.run_until_complete(self.async_fetch_history(history_since, resume_ids))
+
+    def fetch_fills(self, windows: dict, end_ms):
+        """同步入口: 见 async_fetch_fills"""
+        with _loop_lock:
+            return _loop.run_until_complete(self.async_fetch_fills(windows, end_ms))
+
+    def fetch_marks(self):
+        """同步入口: 见 async_fetch_marks"""
+        with _loop_lock:
+            return _loop.run_until_complete(self.async_fetch_marks())
+
+    def fetch_snapshot(self, history_since: dict, resume_ids: dict = None, with_marks: bool = False):
+        """
+        同步入口: 在常驻事件循环上并发拉取本周期所需的全部数据
+        history_since 为各合约类型历史仓位的高水位 {product_type: since}, 见 get_history_positions
+        返回 (全部合约类型的当前持仓列表, {product_type: 历史仓位列表}, 标记价格或 None)
+        """
+        with _loop_lock:
+            return _loop.run_until_complete(self.async_fetch_snapshot(history_since, resume_ids, with_marks))
+
+
+async def _async_warm_up(account: BitgetAccount):
+    account.async_client.session = await _shared_aio_session()
+    await account.async_client._get_timestamp()
+
+
+def warm_up(account: BitgetAccount):
+    """启动预热: 用公共的服务器时间接口在共享的 aiohttp 连接池里建立好 TLS 连接"""
+    with _loop_lock:
+        _loop.run_until_complete(_async_warm_up(account))
+
+
+# 单账户模式下的默认账户 (BITGET_* 环境变量)
+default_account = BitgetAccount("default", API_KEY, SECRET_KEY, PASSPHRASE)
+client = default_account.client
+async_client = default_account.async_client
+
+
+# 兼容单账户的模块级调用方式
+
+def get_positions(product_type=DEFAULT_PRODUCT_TYPE):
+    return default_account.get_positions(product_type)
+
+
+def get_history_positions(since=None, product_type=DEFAULT_PRODUCT_TYPE):
+    return default_account.get_history_positions(since, product_type)
+
+
+def fetch_snapshot(history_since: dict, with_marks: bool = False):
+    return default_account.fetch_snapshot(history_since, with_marks=with_marks)
+
+
+async def async_fetch_all(requests: list):
+    """
+    多个账户并发拉取: requests 为 [(BitgetAccount, {product_type: since}, {product_type: 续翻位置}, 是否拉取标记价格)]，
+    单个账户失败时对应位置为 None
+    """
+    results = await asyncio.gather(*(account.async_fetch_snapshot(since, resume_ids, with_marks)
+                                     for account, since, resume_ids, with_marks in requests),
+                                   return_exceptions=True)
+    snapshots = []
+    for (account, *_), result in zip(requests, results):
+        if isinstance(result, Exception):
+            print(f"[Bitget] 账户 {account.name} 获取数据失败: {result}")
+            result = None
+        snapshots.append(result)
+    return snapshots
 
 
+def fetch_all(requests: list):
+    """同步入口: 在常驻事件循环上并发拉取全部账户的快照"""
+    with _loop_lock:
+        return _loop.run_until_complete(async_fetch_all(requests))
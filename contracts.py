@@ -0,0 +1,100 @@
+# contracts.py - 合约元数据缓存
+# 进程内共享的交易对信息 (价格 / 数量精度、报价币种)，每种合约类型一次 MarketApi.contracts 批量加载，
+# 按 TTL 定期刷新；同步过程中只查本地缓存，不会为单个仓位发请求
+
+import os
+import threading
+import time
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# 元数据刷新间隔 (秒)
+CONTRACTS_TTL = int(os.getenv("CONTRACTS_TTL", 3600))
+# 加载失败后的重试间隔 (秒)，期间继续使用旧数据
+CONTRACTS_RETRY_INTERVAL = 60
+
+
+def _parse_contract(item: dict) -> dict:
+    return {
+        "baseCoin": item.get("baseCoin", ""),
+        "quoteCoin": item.get("quoteCoin", ""),
+        "pricePlace": int(item.get("pricePlace") or 0),
+        "volumePlace": int(item.get("volumePlace") or 0),
+        "sizeMultiplier": float(item.get("sizeMultiplier") or 0),
+    }
+
+
+class ContractCache:
+    """
+    symbol -> 元数据 (各合约类型的 symbol 互不重复，合并成一张表)
+    ensure() 在每个同步周期开始时调用，过期时才请求；查询方法在缓存缺失时返回 None，由调用方回退到旧的口径
+    """
+
+    def __init__(self, ttl: int = CONTRACTS_TTL):
+        self.ttl = ttl
+        self._symbols = {}
+        # product_type -> 下次刷新的时间 (monotonic)
+        self._refresh_at = {}
+        self._lock = threading.Lock()
+
+    def ensure(self, bitget_account, product_types: list):
+        """过期的合约类型各发一次 contracts 请求；其他线程正在刷新时直接返回，使用现有数据"""
+        now = time.monotonic()
+        stale = [t for t in product_types if self._refresh_at.get(t, 0) <= now]
+        if not stale or not self._lock.acquire(blocking=False):
+            return
+        try:
+            for product_type in stale:
+                self._load(bitget_account, product_type)
+        finally:
+            self._lock.release()
+
+    def _load(self, bitget_account, product_type: str):
+        try:
+            response = bitget_account.market_api.contracts({"productType": product_type})
+            if response.get("code") != "00000":
+                raise RuntimeError(response.get("msg"))
+            symbols = {item["symbol"]: _parse_contract(item) for item in response.get("data") or []
+                       if item.get("symbol")}
+        except Exception as e:
+            print(f"[Bitget] 获取合约信息失败 ({product_type}): {e}")
+            self._refresh_at[product_type] = time.monotonic() + min(CONTRACTS_RETRY_INTERVAL, self.ttl)
+            return
+        # 整表替换引用，读取方不需要加锁
+        self._symbols = dict(self._symbols, **symbols)
+        self._refresh_at[product_type] = time.monotonic() + self.ttl
+        print(f"[Bitget] 已加载合约信息 {product_type}: {len(symbols)} 个")
+
+    def get(self, symbol: str):
+        return self._symbols.get(symbol)
+
+    def is_inverse(self, symbol: str):
+        """币本位 (反向) 合约以 USD 报价，盈亏与保证金以基础币计；未知时返回 None"""
+        meta = self.get(symbol)
+        if meta is None:
+            return None
+        return meta["quoteCoin"] == "USD"
+
+    def margin(self, symbol: str, price: float, size: float, leverage: float) -> float:
+        """
+        开仓保证金 (以保证金币种计)
+        Bitget 的持仓数量以基础币计 (合约乘数只是下单步长)：U 本位 = 均价 * 数量 / 杠杆，币本位 = 数量 / 杠杆
+        """
+        if leverage <= 0 or size <= 0:
+            return 0.0
+        if self.is_inverse(symbol):
+            return size / leverage
+        return price * size / leverage
+
+    def round_price(self, symbol: str, price: float) -> float:
+        meta = self.get(symbol)
+        return round(price, meta["pricePlace"]) if meta else price
+
+    def round_volume(self, symbol: str, volume: float) -> float:
+        meta = self.get(symbol)
+        return round(volume, meta["volumePlace"]) if meta else volume
+
+
+# 进程内共享的缓存
+cache = ContractCache()
@@ -2,6 +2,7 @@
 # 负责与飞书多维表格 API 交互
 
 import os
+import threading
 from dotenv import load_dotenv
 
 # Step 2.1: 加载环境变量
@@ -12,33 +13,98 @@ APP_SECRET = os.getenv("FEISHU_APP_SECRET")
 APP_TOKEN = os.getenv("FEISHU_APP_TOKEN")
 TABLE_ID = os.getenv("FEISHU_TABLE_ID")
 
-# 初始化飞书客户端
-import lark_oapi as lark
-from lark_oapi.api.bitable.v1 import *
+# 多维表格批量接口单次最多处理 500 条记录
+BATCH_SIZE = 500
+# 分页查询单页最大条数
+PAGE_SIZE = 500
+# 飞书限流错误码 (应用/接口频率超限)，命中后退避重试的次数
+RATE_LIMIT_CODES = {99991400, 1254290}
+RATE_LIMIT_RETRIES = int(os.getenv("FEISHU_RATE_LIMIT_RETRIES", 3))
+# 令牌无效 / 已过期 (被其他进程刷新或服务端提前作废)，丢弃后重新获取一次
+TOKEN_INVALID_CODES = {99991661, 99991663}
 
-client = lark.Client.builder() \
-    .app_id(APP_ID) \
-    .app_secret(APP_SECRET) \
-    .log_level(lark.LogLevel.WARNING) \
-    .build()
+# 飞书客户端 (进程内唯一，多账户共享同一个 tenant_access_token)
+# 令牌由 token_provider 管理 (过期前主动刷新，可跨进程共享)，每次请求通过 RequestOption 传入
+# 各函数的 table_id / app_token 为空时使用上面的默认表
+from feishu_token import TenantTokenProvider, get_cache
+from rate_limiter import limiter, retry_after_from_headers
 
+token_provider = TenantTokenProvider(APP_ID, APP_SECRET, get_cache())
 
-def create_record(fields: dict) -> str:
+# lark_oapi 的包初始化会加载整个生成的 SDK (1 秒以上)，推迟到第一次调用 (或 warm_up) 时再导入
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                import lark_oapi as lark
+                _client = lark.Client.builder() \
+                    .app_id(APP_ID) \
+                    .app_secret(APP_SECRET) \
+                    .enable_set_token(True) \
+                    .log_level(lark.LogLevel.WARNING) \
+                    .build()
+    return _client
+
+
+def warm_up():
+    """启动预热: 导入 SDK 并准备好 tenant_access_token，第一次写入不再承担这部分延迟"""
+    get_client()
+    token_provider.get()
+
+
+def _call(op: str, request):
+    """
+    调用多维表格记录接口 app_table_record.<op>
+    限流包装: 每次调用前按 "feishu:<op>" 取令牌，
+    命中限流错误码时通知限流器退避 (优先使用响应头里的 Retry-After) 并重试；
+    tenant_access_token 被拒绝时换新令牌重试一次
+    """
+    from lark_oapi import RequestOption
+
+    fn = getattr(get_client().bitable.v1.app_table_record, op)
+    key = f"feishu:{op}"
+    attempt = 0
+    token_retried = False
+    while True:
+        limiter.acquire(key)
+        token = token_provider.get()
+        response = fn(request, RequestOption.builder().tenant_access_token(token).build())
+        if response.code in TOKEN_INVALID_CODES and not token_retried:
+            token_provider.invalidate(token)
+            token_retried = True
+            continue
+        if response.code in RATE_LIMIT_CODES and attempt < RATE_LIMIT_RETRIES:
+            raw = getattr(response, "raw", None)
+            limiter.on_rate_limited(key, retry_after_from_headers(getattr(raw, "headers", None)))
+            attempt += 1
+            continue
+        limiter.on_success(key)
+        return response
+
+
+def create_record(fields: dict, table_id: str = None, app_token: str = None) -> str:
     """
     Step 2.2: 创建表格记录
     在飞书多维表格中插入新记录
     返回新记录的 record_id，失败返回空字符串
     """
+    from lark_oapi.api.bitable.v1 import CreateAppTableRecordRequest, AppTableRecord
+
     try:
         request = CreateAppTableRecordRequest.builder() \
-            .app_token(APP_TOKEN) \
-            .table_id(TABLE_ID) \
+            .app_token(app_token or APP_TOKEN) \
+            .table_id(table_id or TABLE_ID) \
             .request_body(AppTableRecord.builder()
                 .fields(fields)
                 .build()) \
             .build()
         
-        response = client.bitable.v1.app_table_record.create(request)
+        response = _call("create", request)
         
         if response.success():
             record_id = response.data.record.record_id
@@ -52,30 +118,40 @@ def create_record(fields: dict) -> str:
         return ""
 
 
-def find_record(position_id: str) -> str:
+def _filter_info(match: dict):
+    """{列名: 值} -> 各列 "is" 条件的 and 组合"""
+    from lark_oapi.api.bitable.v1 import FilterInfo, Condition
+
+    return FilterInfo.builder() \
+        .conjunction("and") \
+        .conditions([Condition.builder()
+            .field_name(field_name)
+            .operator("is")
+            .value([value])
+            .build() for field_name, value in match.items()]) \
+        .build()
+
+
+def find_record(position_id: str, table_id: str = None, app_token: str = None, match: dict = None) -> str:
     """
     Step 2.3: 查询记录
     根据 positionId 查询飞书表格中的记录
+    match: 额外的 {列名: 值} 过滤条件 (多账户共用一张表时按账户列过滤)
     返回 record_id，未找到返回 None
     """
+    from lark_oapi.api.bitable.v1 import SearchAppTableRecordRequest, SearchAppTableRecordRequestBody
+
     try:
         # 使用搜索 API 查询
         request = SearchAppTableRecordRequest.builder() \
-            .app_token(APP_TOKEN) \
-            .table_id(TABLE_ID) \
+            .app_token(app_token or APP_TOKEN) \
+            .table_id(table_id or TABLE_ID) \
             .request_body(SearchAppTableRecordRequestBody.builder()
-                .filter(FilterInfo.builder()
-                    .conjunction("and")
-                    .conditions([Condition.builder()
-                        .field_name("positionId")
-                        .operator("is")
-                        .value([position_id])
-                        .build()])
-                    .build())
+                .filter(_filter_info(dict(match or {}, positionId=position_id)))
                 .build()) \
             .build()
         
-        response = client.bitable.v1.app_table_record.search(request)
+        response = _call("search", request)
         
         if response.success():
             items = response.data.items
@@ -87,23 +163,73 @@ def find_record(position_id: str) -> str:
         raise e # 抛出异常，中断流程，防止主程序误判为"不存在"而创建重复记录
 
 
-def update_record(record_id: str, fields: dict) -> bool:
+def _text_value(value) -> str:
+    """多行文本字段在 search 返回中是 [{"text": ..., "type": "text"}] 片段列表"""
+    if isinstance(value, list):
+        return "".join(seg.get("text", "") if isinstance(seg, dict) else str(seg) for seg in value)
+    return str(value) if value is not None else ""
+
+
+def load_record_index(table_id: str = None, app_token: str = None, key_field: str = "positionId",
+                      match: dict = None) -> dict:
+    """
+    Step 2.3b: 批量加载 positionId -> record_id 索引
+    分页扫描整张表，只返回 key_field 一列，几次请求即可替代 N 次 find_record
+    match: {列名: 值} 过滤条件，多账户共用一张表时只扫描本账户的行，其他账户的同名键不会混进索引
+    失败时抛出异常，调用方应回退到逐条 find_record，避免误判为"不存在"而重复创建
+    """
+    from lark_oapi.api.bitable.v1 import SearchAppTableRecordRequest, SearchAppTableRecordRequestBody
+
+    index = {}
+    page_token = None
+    while True:
+        builder = SearchAppTableRecordRequest.builder() \
+            .app_token(app_token or APP_TOKEN) \
+            .table_id(table_id or TABLE_ID) \
+            .page_size(PAGE_SIZE)
+        if page_token:
+            builder = builder.page_token(page_token)
+        body = SearchAppTableRecordRequestBody.builder().field_names([key_field])
+        if match:
+            body = body.filter(_filter_info(match))
+        request = builder.request_body(body.build()).build()
+
+        response = _call("search", request)
+        if not response.success():
+            raise RuntimeError(f"加载记录索引失败: {response.code} - {response.msg}")
+
+        for item in response.data.items or []:
+            position_id = _text_value((item.fields or {}).get(key_field))
+            if position_id:
+                index[position_id] = item.record_id
+
+        if not response.data.has_more:
+            break
+        page_token = response.data.page_token
+
+    print(f"[飞书] 加载记录索引: {len(index)} 条")
+    return index
+
+
+def update_record(record_id: str, fields: dict, table_id: str = None, app_token: str = None) -> bool:
     """
     Step 2.4: 更新表格记录
     更新飞书多维表格中的现有记录
     返回布尔值表示成功或失败
     """
+    from lark_oapi.api.bitable.v1 import UpdateAppTableRecordRequest, AppTableRecord
+
     try:
         request = UpdateAppTableRecordRequest.builder() \
-            .app_token(APP_TOKEN) \
-            .table_id(TABLE_ID) \
+            .app_token(app_token or APP_TOKEN) \
+            .table_id(table_id or TABLE_ID) \
             .record_id(record_id) \
             .request_body(AppTableRecord.builder()
                 .fields(fields)
                 .build()) \
             .build()
         
-        response = client.bitable.v1.app_table_record.update(request)
+        response = _call("update", request)
         
         if response.success():
             print(f"[飞书] 更新记录成功: {record_id}")
@@ -116,4 +242,77 @@ def update_record(record_id: str, fields: dict) -> bool:
         return False
 
 
+def _chunks(items: list, size: int = BATCH_SIZE):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def batch_create_records(fields_list: list, table_id: str = None, app_token: str = None,
+                         stop_on_failure: bool = False) -> list:
+    """
+    Step 2.5: 批量创建表格记录
+    按 BATCH_SIZE 自动分片调用 batch_create 接口
+    返回与 fields_list 一一对应的 record_id 列表，失败的分片对应位置为空字符串
+    stop_on_failure: 某个分片失败后不再发送后面的分片 (按顺序推进游标的调用方使用，避免游标之后的行被重复创建)
+    """
+    from lark_oapi.api.bitable.v1 import BatchCreateAppTableRecordRequest, BatchCreateAppTableRecordRequestBody, AppTableRecord
+
+    record_ids = []
+    for chunk in _chunks(fields_list):
+        try:
+            request = BatchCreateAppTableRecordRequest.builder() \
+                .app_token(app_token or APP_TOKEN) \
+                .table_id(table_id or TABLE_ID) \
+                .request_body(BatchCreateAppTableRecordRequestBody.builder()
+                    .records([AppTableRecord.builder().fields(fields).build() for fields in chunk])
+                    .build()) \
+                .build()
+
+            response = _call("batch_create", request)
+
+            if response.success():
+                records = response.data.records or []
+                print(f"[飞书] 批量创建记录成功: {len(records)} 条")
+                ids = [r.record_id for r in records]
+                record_ids.extend(ids + [""] * (len(chunk) - len(ids)))
+            else:
+                print(f"[飞书] 批量创建记录失败: {response.code} - {response.msg}")
+                record_ids.extend([""] * len(chunk))
+        except Exception as e:
+            print(f"[飞书] 批量创建记录异常: {e}")
+            record_ids.extend([""] * len(chunk))
+        if stop_on_failure and "" in record_ids:
+            break
+    return record_ids + [""] * (len(fields_list) - len(record_ids))
+
+
+def batch_update_records(records: list, table_id: str = None, app_token: str = None) -> list:
+    """
+    Step 2.6: 批量更新表格记录
+    records 为 [(record_id, fields), ...]，按 BATCH_SIZE 自动分片调用 batch_update 接口
+    返回更新成功的 record_id 列表
+    """
+    from lark_oapi.api.bitable.v1 import BatchUpdateAppTableRecordRequest, BatchUpdateAppTableRecordRequestBody, AppTableRecord
+
+    updated = []
+    for chunk in _chunks(records):
+        try:
+            request = BatchUpdateAppTableRecordRequest.builder() \
+                .app_token(app_token or APP_TOKEN) \
+                .table_id(table_id or TABLE_ID) \
+                .request_body(BatchUpdateAppTableRecordRequestBody.builder()
+                    .records([AppTableRecord.builder().record_id(record_id).fields(fields).build()
+                              for record_id, fields in chunk])
+                    .build()) \
+                .build()
+
+            response = _call("batch_update", request)
 
+            if response.success():
+                print(f"[飞书] 批量更新记录成功: {len(chunk)} 条")
+                updated.extend(record_id for record_id, _ in chunk)
+            else:
+                print(f"[飞书] 批量更新记录失败: {response.code} - {response.msg}")
+        except Exception as e:
+            print(f"[飞书] 批量更新记录异常: {e}")
+    return updated
@@ -0,0 +1,203 @@
+# feishu_token.py - 飞书 tenant_access_token 提供者
+# 在令牌过期前由后台线程主动刷新，请求永远拿到的是有效令牌；
+# 可选的文件 / SQLite 缓存让多个容器、进程重启之间共用同一个令牌，启动时不需要再走一次鉴权
+
+import os
+import json
+import sqlite3
+import threading
+import time
+import requests
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# 共享缓存: 为空只缓存在内存；以 .db / .sqlite 结尾使用 SQLite，否则为 JSON 文件
+TOKEN_CACHE = os.getenv("FEISHU_TOKEN_CACHE", "")
+# 距过期多少秒时开始刷新 (飞书在剩余有效期不足 30 分钟时才会签发新令牌)
+TOKEN_REFRESH_BEFORE = int(os.getenv("FEISHU_TOKEN_REFRESH_BEFORE", 1200))
+# 刷新失败后的重试间隔 (秒)
+TOKEN_RETRY_INTERVAL = 30
+# 剩余有效期不足该秒数的令牌视为已过期，不再使用
+TOKEN_EXPIRY_SLACK = 60
+TOKEN_URL = "https://open.feishu.cn/open-apis/auth/v3/tenant_access_token/internal"
+
+
+class FileTokenCache:
+    """JSON 文件缓存，临时文件 + rename 原子替换，多个进程同时写入时不会读到半个文件"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def _read_all(self) -> dict:
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def get(self, app_id: str):
+        entry = self._read_all().get(app_id)
+        if not entry:
+            return None
+        return entry["token"], float(entry["expire_at"])
+
+    def set(self, app_id: str, token: str, expire_at: float):
+        data = self._read_all()
+        data[app_id] = {"token": token, "expire_at": expire_at}
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+
+class SqliteTokenCache:
+    """SQLite 缓存 (WAL)，可以与状态库放在同一个挂载目录"""
+
+    def __init__(self, path: str):
+        self.path = path
+        with self._connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS feishu_token "
+                         "(app_id TEXT PRIMARY KEY, token TEXT NOT NULL, expire_at REAL NOT NULL)")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=5)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def get(self, app_id: str):
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT token, expire_at FROM feishu_token WHERE app_id = ?", (app_id,)).fetchone()
+        finally:
+            conn.close()
+        return (row[0], float(row[1])) if row else None
+
+    def set(self, app_id: str, token: str, expire_at: float):
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("INSERT OR REPLACE INTO feishu_token (app_id, token, expire_at) VALUES (?, ?, ?)",
+                             (app_id, token, expire_at))
+        finally:
+            conn.close()
+
+
+def get_cache(path: str = TOKEN_CACHE):
+    if not path:
+        return None
+    if path.endswith((".db", ".sqlite")):
+        return SqliteTokenCache(path)
+    return FileTokenCache(path)
+
+
+class TenantTokenProvider:
+    """
+    tenant_access_token 提供者
+    - get(): 返回当前令牌，只有进程内和共享缓存里都没有有效令牌时才同步请求
+    - 后台线程在过期前 TOKEN_REFRESH_BEFORE 秒刷新；刷新前先看共享缓存，其他进程刚刷新过就直接复用
+    - invalidate(): 令牌被服务端拒绝时丢弃，下一次 get() 重新获取
+    """
+
+    def __init__(self, app_id: str, app_secret: str, cache=None):
+        self.app_id = app_id
+        self.app_secret = app_secret
+        self.cache = cache
+        self._token = None
+        self._expire_at = 0.0
+        # 最近一次被服务端拒绝的令牌，共享缓存里仍是它时不再复用
+        self._rejected = None
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _valid(self, expire_at: float, margin: float) -> bool:
+        return expire_at - time.time() > margin
+
+    def _load_shared(self) -> bool:
+        if self.cache is None:
+            return False
+        try:
+            entry = self.cache.get(self.app_id)
+        except Exception as e:
+            print(f"[飞书] 读取令牌缓存失败: {e}")
+            return False
+        if entry and entry[0] != self._rejected and entry[1] > self._expire_at \
+                and self._valid(entry[1], TOKEN_EXPIRY_SLACK):
+            self._token, self._expire_at = entry
+            return True
+        return False
+
+    def _fetch(self):
+        response = requests.post(TOKEN_URL, json={"app_id": self.app_id, "app_secret": self.app_secret}, timeout=10)
+        data = response.json()
+        if data.get("code") != 0:
+            raise RuntimeError(f"获取 tenant_access_token 失败: {data.get('code')} - {data.get('msg')}")
+        self._token = data["tenant_access_token"]
+        self._expire_at = time.time() + int(data.get("expire", 7200))
+        if self.cache is not None:
+            try:
+                self.cache.set(self.app_id, self._token, self._expire_at)
+            except Exception as e:
+                print(f"[飞书] 写入令牌缓存失败: {e}")
+
+    def refresh(self, force: bool = False):
+        """令牌进入刷新窗口 (或 force) 时更新: 先读共享缓存，仍需要刷新才请求飞书"""
+        with self._lock:
+            if not force and self._token and self._valid(self._expire_at, TOKEN_REFRESH_BEFORE):
+                return
+            if self._load_shared() and self._valid(self._expire_at, TOKEN_REFRESH_BEFORE):
+                return
+            self._fetch()
+
+    def get(self) -> str:
+        if self._thread is None:
+            self.start()
+        token, expire_at = self._token, self._expire_at
+        if token and self._valid(expire_at, TOKEN_EXPIRY_SLACK):
+            if not self._valid(expire_at, TOKEN_REFRESH_BEFORE):
+                # 后台线程还没来得及刷新: 唤醒它，本次仍使用尚未过期的令牌
+                self._wakeup.set()
+            return token
+        with self._lock:
+            if not (self._token and self._valid(self._expire_at, TOKEN_EXPIRY_SLACK)) and not self._load_shared():
+                self._fetch()
+            return self._token
+
+    def invalidate(self, token: str):
+        with self._lock:
+            self._rejected = token
+            if self._token == token:
+                self._token, self._expire_at = None, 0.0
+
+    def _next_delay(self) -> float:
+        if not self._token:
+            return TOKEN_RETRY_INTERVAL
+        return max(self._expire_at - TOKEN_REFRESH_BEFORE - time.time(), 0)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.refresh()
+                delay = self._next_delay()
+            except Exception as e:
+                print(f"[飞书] 刷新 tenant_access_token 失败: {e}")
+                delay = TOKEN_RETRY_INTERVAL
+            self._wakeup.wait(max(delay, 1))
+            self._wakeup.clear()
+
+    def start(self):
+        """启动后台刷新 (幂等)；启动时优先复用共享缓存中的令牌"""
+        with self._lock:
+            if self._thread is None:
+                self._load_shared()
+                self._thread = threading.Thread(target=self._run, name="feishu-token", daemon=True)
+                self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
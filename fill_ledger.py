@@ -0,0 +1,205 @@
+# fill_ledger.py - 成交明细账本
+# 把每一笔成交 (fills) 写入第二张多维表格，并关联到对应的仓位记录；
+# 补仓 (DCA) 时仓位表的入场价会被覆盖，逐笔成交保留在这里
+
+import os
+import threading
+import time
+from bisect import bisect_right
+from dotenv import load_dotenv
+
+import bitget_client
+import contracts
+import feishu_client
+
+load_dotenv()
+
+# 成交明细表，为空时不启用
+FILL_TABLE_ID = os.getenv("FEISHU_FILL_TABLE_ID", "")
+# 关联仓位表的双向链接列名 (为空时只写 positionId 文本列)
+FILL_LINK_FIELD = os.getenv("FEISHU_FILL_LINK_FIELD", "仓位")
+# 拉取间隔 (秒)
+FILL_INTERVAL = int(os.getenv("FILL_INTERVAL", 60))
+# 首次运行时向前补录的天数，0 表示只记录启动之后的成交
+FILL_BACKFILL_DAYS = int(os.getenv("FILL_BACKFILL_DAYS", 0))
+# 成交接口最多支持查询 90 天
+FILL_MAX_LOOKBACK_MS = 90 * 86400 * 1000
+# 成交入库可能有延迟，只拉取这么久之前的成交，避免游标越过尚未可见的成交 (毫秒)
+FILL_SETTLE_MS = 5000
+# 开仓成交时间与仓位 cTime 之间允许的误差 (毫秒)
+OPEN_TIME_TOLERANCE_MS = 1000
+# 所属仓位还没进入缓存 (创建仍在发件箱中) 的成交最多等待这么久，超时后不带关联写入 (毫秒)
+FILL_MATCH_WAIT_MS = 30 * 60 * 1000
+
+
+def _fill_key(fill: dict) -> tuple:
+    # 成交 ID 单调递增，与时间一起作为游标，同一毫秒内的多笔成交也不会漏掉
+    return int(fill.get("cTime") or 0), int(fill.get("tradeId") or 0)
+
+
+def fill_hold_side(fill: dict) -> str:
+    """
+    推断成交所属仓位的方向
+    双向持仓: open/close + buy/sell；单向持仓: buy_single / sell_single；
+    强平 / 减仓等 tradeSide 形如 burst_close_long、reduce_close_short
+    """
+    trade_side = str(fill.get("tradeSide", ""))
+    side = fill.get("side", "")
+    if trade_side.endswith("_long"):
+        return "long"
+    if trade_side.endswith("_short"):
+        return "short"
+    if "close" in trade_side:
+        return "long" if side == "sell" else "short"
+    return "long" if side == "buy" else "short"
+
+
+class FillLedger:
+    """
+    单个账户的成交账本
+    - 每种合约类型一个游标 (cTime, tradeId)，只拉取游标之后的成交，不会重复拉取
+    - 按时间正序批量写入，只推进到连续写入成功的最后一笔，失败的下次重新拉取
+    """
+
+    def __init__(self, account, table_id: str = None):
+        self.account = account
+        self.table_id = table_id or FILL_TABLE_ID
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _cursor_key(self, product_type: str) -> str:
+        return f"fill_cursor:{product_type}"
+
+    def _position_index(self) -> dict:
+        """(symbol, holdSide) -> ([开仓时间], [(unique_id, record_id, 平仓时间)])，均按开仓时间排序"""
+        index = {}
+        for unique_id, data in self.account.state.cache_items():
+            symbol_side, _, c_time = unique_id.rpartition("_")
+            symbol, _, hold_side = symbol_side.rpartition("_")
+            if c_time.isdigit():
+                index.setdefault((symbol, hold_side), []).append(
+                    (int(c_time), unique_id, data.get("record_id"), data.get("utime")))
+        for key, positions in index.items():
+            positions.sort()
+            index[key] = ([p[0] for p in positions], [p[1:] for p in positions])
+        return index
+
+    @staticmethod
+    def _match_position(index: dict, fill: dict):
+        """
+        找到该成交所属的仓位: 同币种同方向、开仓时间不晚于成交时间的最近一个
+        返回 (unique_id, record_id)；所属仓位还不在缓存里时返回 None，避免关联到上一个已平仓的仓位
+        """
+        entry = index.get((fill.get("symbol", ""), fill_hold_side(fill)))
+        if not entry:
+            return None
+        fill_time = int(fill.get("cTime") or 0)
+        times, positions = entry
+        i = bisect_right(times, fill_time + OPEN_TIME_TOLERANCE_MS)
+        if i == 0:
+            return None
+        unique_id, record_id, u_time = positions[i - 1]
+        # 最近的仓位在这笔成交之前已经平仓: 成交属于一个还没缓存的新仓位
+        if not record_id or (u_time and fill_time > int(u_time) + OPEN_TIME_TOLERANCE_MS):
+            return None
+        return unique_id, record_id
+
+    def _to_fields(self, fill: dict, unique_id: str, record_id: str) -> dict:
+        hold_side = fill_hold_side(fill)
+        action = "平" if "close" in str(fill.get("tradeSide", "")) else "开"
+        fee = sum(float(item.get("totalFee") or 0) for item in fill.get("feeDetail") or [])
+        symbol = fill.get("symbol", "")
+        fields = {
+            "成交时间": int(fill.get("cTime") or 0),
+            "币种": symbol,
+            "方向": action + ("多" if hold_side == "long" else "空"),
+            "成交价": contracts.cache.round_price(symbol, float(fill.get("price") or 0)),
+            "数量": contracts.cache.round_volume(symbol, float(fill.get("baseVolume") or 0)),
+            "成交额": float(fill.get("quoteVolume") or 0),
+            "手续费": fee,
+            "已实现盈亏": float(fill.get("profit") or 0),
+            "tradeId": str(fill.get("tradeId", "")),
+            "orderId": str(fill.get("orderId", "")),
+            "positionId": unique_id or "",
+        }
+        if FILL_LINK_FIELD and record_id:
+            fields[FILL_LINK_FIELD] = [record_id]
+        return self.account.tag(fields)
+
+    def _cursor(self, product_type: str, now_ms: int) -> tuple:
+        cursor = self.account.state.get_meta(self._cursor_key(product_type))
+        if cursor is None:
+            cursor = [now_ms - FILL_BACKFILL_DAYS * 86400 * 1000, 0]
+        return int(cursor[0]), int(cursor[1])
+
+    def sync_product_type(self, product_type: str, fills: list, now_ms: int):
+        """处理一种合约类型在游标之后拉取到的成交 (fills 为 None 表示拉取失败)"""
+        if fills is None:
+            return
+        state = self.account.state
+        last_key = self._cursor(product_type, now_ms)
+        fills = sorted((f for f in fills if _fill_key(f) > last_key), key=_fill_key)
+        if not fills:
+            state.set_meta(self._cursor_key(product_type), list(last_key))
+            return
+
+        index = self._position_index()
+        matches = []
+        for fill in fills:
+            match = self._match_position(index, fill)
+            if match is None:
+                if now_ms - int(fill.get("cTime") or 0) < FILL_MATCH_WAIT_MS:
+                    # 所属仓位还没写入仓位表: 游标停在这笔之前，下个周期再匹配
+                    break
+                # 等待超时 (如系统启动前开的仓位)，不带关联写入
+                match = (None, None)
+            matches.append(match)
+        if len(matches) < len(fills):
+            print(f"[Core] 成交明细 {product_type}: {len(fills) - len(matches)} 笔等待所属仓位写入")
+        fills = fills[:len(matches)]
+        if not fills:
+            return
+        fields_list = [self._to_fields(fill, *match) for fill, match in zip(fills, matches)]
+        # 游标只能推进到连续成功的位置，某个分片失败后不再发送后面的分片，否则下次会重复创建
+        record_ids = feishu_client.batch_create_records(fields_list, self.table_id, self.account.app_token,
+                                                        stop_on_failure=True)
+
+        # 只推进到连续成功的最后一笔
+        written = 0
+        for record_id in record_ids:
+            if not record_id:
+                break
+            written += 1
+        if written:
+            last_key = _fill_key(fills[written - 1])
+            state.set_meta(self._cursor_key(product_type), list(last_key))
+        print(f"[飞书] 成交明细 {product_type}: 写入 {written}/{len(fills)} 笔")
+
+    def sync(self):
+        # 各合约类型的成交在共享事件循环上并发拉取，再按类型依次写入
+        now_ms = int(time.time() * 1000) - FILL_SETTLE_MS
+        windows = {t: max(self._cursor(t, now_ms)[0], now_ms - FILL_MAX_LOOKBACK_MS)
+                   for t in bitget_client.PRODUCT_TYPES}
+        fills_by_type = self.account.bitget.fetch_fills(windows, now_ms)
+        for product_type in bitget_client.PRODUCT_TYPES:
+            self.sync_product_type(product_type, fills_by_type.get(product_type), now_ms)
+        # 游标立即落盘，崩溃重启后不会重复写入已写入的成交
+        self.account.state.flush()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.sync()
+            except Exception as e:
+                print(f"[Core] 成交明细同步异常 ({self.account.name}): {e}")
+            self._stop.wait(FILL_INTERVAL)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name=f"fills-{self.account.name}", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout: float = 10):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
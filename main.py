@@ -3,13 +3,22 @@
 
 import os
 import json
+import hashlib
+import queue
+import signal
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 
 # 导入功能模块
 import bitget_client
 import feishu_client
+import state_store
+import analytics
+import contracts
+from accounts import SyncAccount, load_account_configs
 import logging
 from logging.handlers import TimedRotatingFileHandler
 
@@ -50,6 +59,14 @@ console_handler.setFormatter(console_formatter)
 logger.addHandler(file_handler)
 logger.addHandler(console_handler)
 
+# 3. Bitget SDK 日志: 默认只输出 WARNING 以上，不格式化任何响应体
+#    排查问题时设 BITGET_LOG_LEVEL=DEBUG，并可用 BITGET_DEBUG_SAMPLE=0.01 只采样 1% 的请求
+from bitget.log import logger as bitget_logger, set_debug_sample_rate
+bitget_logger.setLevel(os.getenv("BITGET_LOG_LEVEL", "WARNING").upper())
+bitget_logger.addHandler(file_handler)
+bitget_logger.addHandler(console_handler)
+set_debug_sample_rate(os.getenv("BITGET_DEBUG_SAMPLE", 1.0))
+
 
 def log_info(msg):
     logger.info(msg)
@@ -58,30 +75,65 @@ def log_error(msg):
     logger.error(msg)
 
 
-STATE_FILE = "state.json"
 # 默认轮询间隔 10 秒，可通过环境变量覆盖
 POLL_INTERVAL = int(os.getenv("POLL_INTERVAL", 10))
+# 持仓中随行情变化的字段: 单独变化时不触发写入，随其他字段的变更一起带上最新值
+VOLATILE_FIELDS = {"收益额", "收益率", "持仓时间"}
+# 浮动盈亏刷新间隔 (秒): 按标记价格重算持仓的收益额 / 收益率，每个间隔最多一次批量写入，0 表示关闭
+MTM_INTERVAL = int(os.getenv("MTM_INTERVAL", 0))
+# 收益率变化超过该值 (0.01 = 1 个百分点) 的持仓才写入
+MTM_ROE_THRESHOLD = float(os.getenv("MTM_ROE_THRESHOLD", 0.01))
+# 拉取与处理之间的快照队列长度 (处理落后时只保留最新的快照)
+PIPELINE_QUEUE_SIZE = 1
+# 同步模式: poll (REST 轮询，默认) / ws (WebSocket 事件驱动 + 低频 REST 对账)
+SYNC_MODE = os.getenv("SYNC_MODE", "poll").lower()
+# ws 模式下 REST 全量对账的间隔 (秒)
+RECONCILE_INTERVAL = int(os.getenv("RECONCILE_INTERVAL", 300))
+# 启动预热: 第一次同步前并行导入飞书 SDK / 准备令牌 / 建立 Bitget 连接 / 加载合约元数据
+WARMUP = os.getenv("WARMUP", "1") == "1"
+# ws 模式下等待连接登录就绪的超时 (秒)，超时或登录被拒绝时关闭连接，等待一个轮询间隔后重建
+WS_READY_TIMEOUT = int(os.getenv("WS_READY_TIMEOUT", 30))
+# 平仓后历史接口可能有延迟，未查到时的重试间隔 (秒)
+CLOSE_RETRY_INTERVAL = 3
+# 超过该时长 (秒) 仍未在历史中查到的平仓不再单独重试，交给 REST 对账补录
+CLOSE_RETRY_TIMEOUT = 120
+# 首次运行 (没有高水位) 时向前补录的天数，0 表示只取最新一页
+HISTORY_BACKFILL_DAYS = int(os.getenv("HISTORY_BACKFILL_DAYS", 0))
+# Bitget 历史仓位接口最多支持查询 90 天
+HISTORY_MAX_LOOKBACK_MS = 90 * 86400 * 1000
+
+
+def load_state(account: str = None) -> state_store.SyncState:
+    """
+    Step 3.1: 状态读取
+    进程启动时加载一次 (默认 SQLite，可通过 STATE_BACKEND=json 切回 state.json)，
+    之后整个生命周期都在内存中读写；多账户模式下每个账户一份
+    """
+    return state_store.SyncState(state_store.get_backend(account))
 
 
-def load_state() -> dict:
-    """Step 3.1: 状态读取"""
-    if os.path.exists(STATE_FILE):
-        try:
-            with open(STATE_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except Exception as e:
-            print(f"[Core] 加载状态文件失败: {e}")
-            return {}
-    return {}
-
-
-def save_state(state: dict):
-    """Step 3.2: 状态写入"""
-    try:
-        with open(STATE_FILE, 'w', encoding='utf-8') as f:
-            json.dump(state, f, indent=4, ensure_ascii=False)
-    except Exception as e:
-        print(f"[Core] 保存状态文件失败: {e}")
+def load_accounts() -> list:
+    """
+    配置了 ACCOUNTS_FILE 时按文件创建多个账户，否则使用 BITGET_* / FEISHU_TABLE_ID 的单账户
+    """
+    configs = load_account_configs()
+    if not configs:
+        return [SyncAccount(bitget_client.default_account, load_state())]
+    accounts = []
+    for config in configs:
+        bitget = bitget_client.BitgetAccount(config["name"], config["api_key"],
+                                             config["secret_key"], config["passphrase"])
+        accounts.append(SyncAccount(bitget, load_state(config["name"]),
+                                    config.get("table_id"), config.get("app_token"), config.get("fill_table_id")))
+    return accounts
+
+
+def save_state(state: state_store.SyncState, force: bool = False):
+    """Step 3.2: 状态写入 (只写变化的条目，默认按防抖间隔合并落盘)"""
+    if force:
+        state.flush()
+    else:
+        state.maybe_flush()
 
 
 def get_unique_id(pos: dict) -> str:
@@ -95,7 +147,7 @@ def get_unique_id(pos: dict) -> str:
     return f"{symbol}_{side}_{c_time}"
 
 
-def calculate_roe(pnl, margin_size=0, open_avg=0, total=0, leverage=0):
+def calculate_roe(pnl, margin_size=0, open_avg=0, total=0, leverage=0, symbol=""):
     """计算收益率 (%)"""
     try:
         pnl = float(pnl)
@@ -104,7 +156,7 @@ def calculate_roe(pnl, margin_size=0, open_avg=0, total=0, leverage=0):
         
         # 否则尝试推算保证金
         if open_avg and total and leverage:
-             margin = (float(open_avg) * float(total)) / int(leverage)
+             margin = contracts.cache.margin(symbol, float(open_avg), float(total), int(leverage))
              if margin > 0:
                  return round((pnl / margin), 4)
         return 0.0
@@ -132,31 +184,167 @@ def format_duration(start_ms, end_ms):
         return ""
 
 
-def sync_tasks():
-    state = load_state()
-    synced_ids = set(state.get("synced_ids", []))
-    
-    # 智能缓存：不仅存 Record ID，还存关键状态 (Entry Price, Leverage)
-    # 用于本地对比，决定是否需要调用 API 更新
-    # 结构: {"unique_id": {"record_id": "xxx", "entry_price": 1.23, "leverage": 20}}
-    feishu_cache = state.get("feishu_cache", {})
-    
-    # 已完结 ID 集合 (防止重复更新历史)
-    finalized_ids = set(state.get("finalized_ids", []))
-    
-    print(f"\n[{datetime.now().strftime('%H:%M:%S')}] 开始同步 (间隔: {POLL_INTERVAL}s)...")
-    
-    # ==========================
-    # 1. 同步当前持仓 (Open Positions)
-    # ==========================
-    try:
-        open_positions = bitget_client.get_positions()
-    except Exception as e:
-        print(f"[Bitget] 获取持仓失败: {e}")
-        open_positions = []
-        
+def mark_pnl(pos: dict, mark_price: float) -> float:
+    """按标记价格计算持仓的未实现盈亏"""
+    entry_price = float(pos.get("openPriceAvg") or pos.get("openAvgPrice") or 0)
+    size = float(pos.get("total") or 0)
+    direction = 1 if pos.get("holdSide") == "long" else -1
+    if entry_price <= 0 or mark_price <= 0:
+        return 0.0
+    inverse = contracts.cache.is_inverse(pos.get("symbol", ""))
+    if inverse is None:
+        inverse = pos.get("marginCoin") not in (None, "", "USDT", "USDC")
+    if inverse:
+        # 币本位 (反向) 合约: 盈亏以保证金币种计
+        return direction * size * (mark_price - entry_price) / mark_price
+    return direction * size * (mark_price - entry_price)
+
+
+def field_hashes(fields: dict) -> dict:
+    """每个字段值的短摘要 (4 字节 blake2b)，缓存里只存摘要不存原值"""
+    return {
+        name: hashlib.blake2b(json.dumps(value, ensure_ascii=False, sort_keys=True).encode("utf-8"),
+                              digest_size=4).hexdigest()
+        for name, value in fields.items()
+    }
+
+
+def diff_fields(fields: dict, hashes: dict, last_hashes: dict) -> dict:
+    """与上次写入的摘要对比，只返回变化的列"""
+    return {name: value for name, value in fields.items() if last_hashes.get(name) != hashes[name]}
+
+
+def history_cursor_key(product_type: str) -> str:
+    # USDT-FUTURES 沿用旧的键名，升级后不需要重新补录
+    if product_type == bitget_client.DEFAULT_PRODUCT_TYPE:
+        return "history_cursor"
+    return f"history_cursor:{product_type}"
+
+
+def history_resume_key(product_type: str) -> str:
+    return f"history_resume:{product_type}"
+
+
+def get_history_since(state: state_store.SyncState, product_type: str = bitget_client.DEFAULT_PRODUCT_TYPE):
+    """
+    计算本次历史仓位增量拉取的起点 (毫秒)，每种合约类型各自一个高水位
+    - 高水位 history_cursor: 上次已完整处理到的最大 utime
+    - 已从持仓中消失但尚未完结的仓位以开仓时间兜底，确保长持仓平仓后一定在拉取窗口内；
+      仍在持仓中的仓位不参与，否则一个持有 60 天的仓位会让每个周期都重新翻 60 天的历史
+    """
+    now_ms = int(time.time() * 1000)
+    cursor = state.get_meta(history_cursor_key(product_type))
+    if cursor is None:
+        if HISTORY_BACKFILL_DAYS > 0:
+            return max(now_ms - HISTORY_BACKFILL_DAYS * 86400 * 1000, now_ms - HISTORY_MAX_LOOKBACK_MS)
+        return None
+
+    since = int(cursor)
+    holding_ids = set(state.get_meta("holding_ids", []))
+    for unique_id in state.get_meta("open_ids", []):
+        if unique_id in holding_ids:
+            continue
+        c_time_ms = int(unique_id.rsplit("_", 1)[-1] or 0)
+        if c_time_ms > 0:
+            since = min(since, c_time_ms)
+    return max(since, now_ms - HISTORY_MAX_LOOKBACK_MS)
+
+
+def get_history_since_all(state: state_store.SyncState) -> dict:
+    """所有已配置合约类型的拉取起点 {product_type: since}"""
+    return {product_type: get_history_since(state, product_type) for product_type in bitget_client.PRODUCT_TYPES}
+
+
+def get_history_resume_all(state: state_store.SyncState) -> dict:
+    """上次翻页被截断的合约类型的续翻位置 {product_type: idLessThan}"""
+    return {product_type: state.get_meta(history_resume_key(product_type))
+            for product_type in bitget_client.PRODUCT_TYPES if state.get_meta(history_resume_key(product_type))}
+
+
+def merge_history(history_by_type: dict) -> list:
+    """把各合约类型的历史仓位合并成一个列表 (新 -> 旧)，在同一次比对中处理"""
+    merged = [pos for history_list in history_by_type.values() for pos in history_list]
+    merged.sort(key=lambda pos: int(pos.get("utime") or pos.get("uTime") or 0), reverse=True)
+    return merged
+
+
+def advance_history_cursor(account: SyncAccount, history_by_type: dict):
+    """
+    推进高水位 (按合约类型分别推进，某一类型拉取失败不影响其他类型):
+    全部完结 (或完结写入已进入发件箱) 时推到最新的 utime；
+    若有未处理的条目，停在最早的未处理条目之前，下次会重新拉到它；
+    翻页被截断 (更早的仓位还没拉到) 时不推进，记下续翻位置，下个周期从截断处继续向前翻
+    """
+    state = account.state
+    for product_type, history_list in history_by_type.items():
+        resume_id = getattr(history_list, "resume_id", None)
+        state.set_meta(history_resume_key(product_type), resume_id)
+        if resume_id:
+            print(f"[Bitget] {product_type} 历史仓位超过 {bitget_client.HISTORY_MAX_PAGES} 页，下个周期继续向前翻页")
+            continue
+        utimes = []
+        pending = []
+        for pos in history_list:
+            u_time_ms = int(pos.get("utime") or pos.get("uTime") or 0)
+            utimes.append(u_time_ms)
+            if not account.is_settled(get_unique_id(pos)):
+                pending.append(u_time_ms)
+        if not utimes:
+            continue
+        cursor = max(utimes)
+        if pending:
+            cursor = min(cursor, min(pending) - 1)
+        state.set_meta(history_cursor_key(product_type), cursor)
+
+
+def track_open_ids(state: state_store.SyncState, current_holding_ids: set = None):
+    """
+    维护 open_ids (用于历史拉取窗口兜底): 当前持仓 + 已消失但尚未完结的仓位
+    平仓后历史接口可能有延迟，保留到完结 (或超出接口 90 天查询范围) 为止
+    """
+    now_ms = int(time.time() * 1000)
+    tracked = set(state.get_meta("open_ids", []))
+    if current_holding_ids is not None:
+        tracked |= current_holding_ids
+        # 仍在持仓中的仓位不需要拉历史，见 get_history_since
+        state.set_meta("holding_ids", sorted(current_holding_ids))
+    else:
+        current_holding_ids = set(state.get_meta("holding_ids", []))
+    kept = set()
+    for unique_id in tracked:
+        if unique_id in current_holding_ids:
+            kept.add(unique_id)
+        elif not state.is_finalized(unique_id) and \
+                now_ms - int(unique_id.rsplit("_", 1)[-1] or 0) < HISTORY_MAX_LOOKBACK_MS:
+            kept.add(unique_id)
+    state.set_meta("open_ids", sorted(kept))
+
+
+def flush_writes(account: SyncAccount, pending_creates, pending_updates):
+    """
+    把本周期收集的飞书写入交给发件箱
+    条目先持久化再由后台线程批量发送；只有写入成功后才会进入缓存 / 完结集合，
+    失败的条目留在发件箱中退避重试，不需要下个周期重新决策
+    """
+    account.outbox.enqueue(pending_creates, pending_updates)
+
+
+def ensure_contracts(account: SyncAccount):
+    """合约元数据过期时批量刷新 (每种合约类型一次请求)，之后的比对只查本地缓存"""
+    contracts.cache.ensure(account.bitget, bitget_client.PRODUCT_TYPES)
+
+
+def sync_open_positions(account: SyncAccount, open_positions: list,
+                        pending_creates: dict, pending_updates: dict) -> set:
+    """
+    当前持仓的决策：新增 / 补仓调杠杆才排入写入队列，浮动盈亏变化忽略
+    返回本次快照中仍持仓的 unique_id 集合
+    """
+    state = account.state
     print(f"[Core] 当前持仓: {len(open_positions)} 个")
-    
+    # 最近一份持仓快照，ws 模式下定时刷新浮动盈亏时复用
+    account.open_positions = open_positions
+
     current_holding_ids = set()
 
     for pos in open_positions:
@@ -165,8 +353,9 @@ def sync_tasks():
         
         # 提取关键数据
         c_time_ms = int(pos.get("cTime") or 0)
-        # 兼容不同接口的字段名
-        entry_price = float(pos.get("openPriceAvg") or pos.get("openAvgPrice") or 0)
+        # 兼容不同接口的字段名，按交易对的价格精度取整
+        entry_price = contracts.cache.round_price(pos.get("symbol", ""),
+                                                  float(pos.get("openPriceAvg") or pos.get("openAvgPrice") or 0))
         leverage = int(pos.get("leverage", 0))
         
         # 浮动盈亏 (即便我们平时不更新它，但如果触发更新时还是需要带上最新的)
@@ -190,74 +379,118 @@ def sync_tasks():
             "平仓时间": None,
             "持仓时间": format_duration(c_time_ms, int(time.time() * 1000)) + " (ing)"
         }
+        account.tag(fields)
         
         # === 核心优化逻辑 ===
-        cached_data = feishu_cache.get(unique_id)
+        cached_data = state.get_cache(unique_id)
+        hashes = field_hashes(fields)
         
         if not cached_data:
             # Case 1: 全新持仓 -> 必须创建
-            print(f"  -> 🟢 新增持仓: {fields['币种']} (API Call)")
+            print(f"  -> 🟢 新增持仓: {fields['币种']} (Batch)")
+            cache_fields = {"entry_price": entry_price, "leverage": leverage, "h": hashes, "mtm_roe": roe}
             # 先尝试找一下万一已有记录 (防止 state 丢失导致重复创建)
-            existing_id = feishu_client.find_record(unique_id)
+            existing_id = account.lookup_record_id(unique_id)
             if existing_id:
-                record_id = existing_id
-                print(f"     (发现已存在记录: {record_id})")
-                feishu_client.update_record(record_id, fields)
+                print(f"     (发现已存在记录: {existing_id})")
+                pending_updates[unique_id] = (existing_id, fields, cache_fields, False)
             else:
-                record_id = feishu_client.create_record(fields)
-            
-            if record_id:
-                feishu_cache[unique_id] = {
-                    "record_id": record_id,
-                    "entry_price": entry_price,
-                    "leverage": leverage
-                }
-                synced_ids.add(unique_id)
+                pending_creates[unique_id] = (fields, cache_fields, False)
 
         else:
-            # Case 2: 已存在的持仓 -> 检查是否发生"结构性变更" (DCA)
-            last_entry_price = cached_data.get("entry_price", 0)
-            last_leverage = cached_data.get("leverage", 0)
+            # Case 2: 已存在的持仓 -> 按字段摘要对比，检查除浮动盈亏外是否有列发生变化 (补仓 / 调杠杆 / ...)
             record_id = cached_data.get("record_id")
-            
-            # 判断是否有关键变化 (价格变动超过 0.0001% 视为补仓/减仓; 杠杆变化)
-            # 浮动盈亏的变化被忽略，不触发 API 调用
-            is_dca_event = abs(entry_price - last_entry_price) > (entry_price * 0.000001) or leverage != last_leverage
-            
-            if is_dca_event:
-                print(f"  -> 🟡 仓位变动(补仓/调杠杆): {fields['币种']} (API Call)")
-                success = feishu_client.update_record(record_id, fields)
-                if success:
-                    # 更新缓存
-                    feishu_cache[unique_id]["entry_price"] = entry_price
-                    feishu_cache[unique_id]["leverage"] = leverage
+            last_hashes = cached_data.get("h")
+
+            if last_hashes is None:
+                # 旧版缓存没有字段摘要: 沿用入场价 / 杠杆判断 (价格变动超过 0.0001% 视为补仓/减仓)
+                last_entry_price = cached_data.get("entry_price", 0)
+                last_leverage = cached_data.get("leverage", 0)
+                is_dca_event = abs(entry_price - last_entry_price) > (entry_price * 0.000001) or leverage != last_leverage
+                if not is_dca_event:
+                    # 视为飞书中已是当前的非浮动字段，补记摘要，之后按字段对比
+                    state.update_cache(unique_id, h={k: v for k, v in hashes.items() if k not in VOLATILE_FIELDS})
+                    continue
+                changed = fields
+            else:
+                changed = diff_fields(fields, hashes, last_hashes)
+
+            if changed.keys() - VOLATILE_FIELDS:
+                print(f"  -> 🟡 仓位变动({'/'.join(sorted(changed.keys() - VOLATILE_FIELDS))}): {fields['币种']} (Batch)")
+                cache_fields = {"entry_price": entry_price, "leverage": leverage, "mtm_roe": roe,
+                                "h": dict(last_hashes or {}, **{k: hashes[k] for k in changed})}
+                # 只发送变化的列 (浮动盈亏顺带更新为最新值)
+                pending_updates[unique_id] = (record_id, changed, cache_fields, False)
             else:
                 # Case 3: 只有浮动盈亏变化 -> 跳过更新 (省钱!)
                 # print(f"  -> ⚪️ 忽略浮动盈亏: {fields['币种']} (Cached)")
                 pass
 
-    # 保存缓存状态
-    state["feishu_cache"] = feishu_cache
-    state["synced_ids"] = list(synced_ids)
-    save_state(state)
+    return current_holding_ids
 
-    # ==========================
-    # 2. 同步历史仓位 (History Positions)
-    # ==========================
-    try:
-        history_list = bitget_client.get_history_positions()
-    except Exception as e:
-        print(f"[Bitget] 获取历史失败: {e}")
-        history_list = []
-        
-    print(f"[Core] 历史记录: {len(history_list)} 条 (最近)")
+
+def mark_refresh_due(account: SyncAccount) -> bool:
+    return MTM_INTERVAL > 0 and time.monotonic() - account.last_mark_refresh >= MTM_INTERVAL
+
+
+def refresh_marks(account: SyncAccount, open_positions: list, pending_updates: dict, marks: dict = None):
+    """
+    按标记价格刷新持仓的浮动盈亏 (每个 MTM_INTERVAL 最多一次)
+    每种合约类型一次 tickers 请求取全部标记价格 (轮询模式随快照一起并发拉取，传入 marks；
+    否则在事件循环上并发拉取各合约类型)，只写入收益率变化超过 MTM_ROE_THRESHOLD 的持仓，
+    写入随本周期的其他更新一起进入发件箱，由一次批量更新发出
+    """
+    account.last_mark_refresh = time.monotonic()
+    state = account.state
+    if marks is None:
+        marks = account.bitget.fetch_marks()
+    if not marks:
+        return
+
+    now_ms = int(time.time() * 1000)
+    refreshed = 0
+    for pos in open_positions:
+        unique_id = get_unique_id(pos)
+        cached_data = state.get_cache(unique_id)
+        # 尚未创建的记录不刷新；本周期已排入更新的持仓已带上最新的浮动盈亏
+        if not cached_data or not cached_data.get("record_id") or unique_id in pending_updates:
+            continue
+        mark_price = marks.get(pos.get("symbol", ""))
+        if not mark_price:
+            continue
+        pnl = mark_pnl(pos, mark_price)
+        roe = calculate_roe(pnl, pos.get("marginSize"), pos.get("openPriceAvg"), pos.get("total"), pos.get("leverage"),
+                            symbol=pos.get("symbol", ""))
+        last_roe = cached_data.get("mtm_roe")
+        if last_roe is not None and abs(roe - float(last_roe)) < MTM_ROE_THRESHOLD:
+            continue
+        c_time_ms = int(pos.get("cTime") or 0)
+        fields = {
+            "收益额": round(pnl, 4),
+            "收益率": roe,
+            "持仓时间": format_duration(c_time_ms, now_ms) + " (ing)",
+        }
+        cache_fields = {"mtm_roe": roe, "h": dict(cached_data.get("h") or {}, **field_hashes(fields))}
+        pending_updates[unique_id] = (cached_data["record_id"], fields, cache_fields, False)
+        refreshed += 1
+    if refreshed:
+        print(f"[Core] 浮动盈亏刷新: {refreshed} 个持仓")
+
+
+def sync_history_positions(account: SyncAccount, history_list: list,
+                           pending_creates: dict, pending_updates: dict):
+    """历史仓位的决策：未完结的仓位写入最终结果并标记完结"""
+    state = account.state
+    print(f"[Core] 历史记录: {len(history_list)} 条 (增量)")
     history_list.reverse()
+    # 本次完结的仓位，追加到统计用的导出文件
+    closed = []
     
     for pos in history_list:
         unique_id = get_unique_id(pos)
         
-        # 如果已经标记为"完结"，直接跳过 (绝对零消耗)
-        if unique_id in finalized_ids:
+        # 如果已经标记为"完结" (或完结写入已在发件箱中)，直接跳过 (绝对零消耗)
+        if account.is_settled(unique_id):
             continue
             
         # 准备数据
@@ -268,17 +501,16 @@ def sync_tasks():
         final_profit = net_profit if net_profit != 0 else pnl
         
         # 尝试从缓存获取之前的 marginSize 来计算精确 ROE
-        cached_data = feishu_cache.get(unique_id, {})
+        cached_data = state.get_cache(unique_id) or {}
         # 注意: 这里的 openAvg 可能是补仓后的均价，这是我们想要的
-        open_avg = float(pos.get("openAvgPrice", 0))
+        symbol = pos.get("symbol", "")
+        open_avg = contracts.cache.round_price(symbol, float(pos.get("openAvgPrice", 0)))
         total_vol = float(pos.get("openTotalPos", 0)) # 总成交量
         leverage = int(pos.get("leverage", 0))
         
         # 自动计算 ROE (净收益 / 保证金)
-        # 保证金 = (均价 * 数量) / 杠杆
-        cal_margin = 0
-        if leverage > 0 and total_vol > 0:
-            cal_margin = (open_avg * total_vol) / leverage
+        # 保证金 = (均价 * 数量) / 杠杆 (币本位合约为 数量 / 杠杆)
+        cal_margin = contracts.cache.margin(symbol, open_avg, total_vol, leverage)
             
         roe = 0
         if cal_margin > 0:
@@ -286,10 +518,10 @@ def sync_tasks():
         
         fields = {
             "开仓时间": c_time_ms,
-            "币种": pos.get("symbol", ""),
+            "币种": symbol,
             "方向": "多" if pos.get("holdSide") == "long" else "空",
             "入场价": open_avg,
-            "出场价": float(pos.get("closeAvgPrice", 0)),
+            "出场价": contracts.cache.round_price(symbol, float(pos.get("closeAvgPrice", 0))),
             "收益额": final_profit,
             "收益率": roe, # 使用一定要重新计算的 ROE
             "状态": "盈利" if final_profit > 0 else "亏损",
@@ -299,46 +531,353 @@ def sync_tasks():
         }
         if leverage > 0:
             fields["杠杆"] = leverage
+        account.tag(fields)
 
         # 查找 Record ID (优先本地缓存)
         record_id = cached_data.get("record_id")
         
         if not record_id:
             # 缓存里没有，说明可能是系统还没跑时开的单，去飞书查一次
-            record_id = feishu_client.find_record(unique_id)
+            record_id = account.lookup_record_id(unique_id)
         
+        closed.append(analytics.closed_record(pos))
+        hashes = field_hashes(fields)
+
         if record_id:
-            log_info(f"  -> 🔵 订单完结: {fields['币种']} (API Call)")
-            success = feishu_client.update_record(record_id, fields)
-            if success:
-                finalized_ids.add(unique_id)
-                # 完结后可以清除 cache 里的过程数据，但为了 ID 映射建议保留
+            # 只有缓存里的记录才知道上次写入了什么；从飞书查到的记录发送全部列
+            last_hashes = cached_data.get("h") if cached_data.get("record_id") == record_id else None
+            changed = diff_fields(fields, hashes, last_hashes) if last_hashes is not None else fields
+            # 同一周期内如果持仓阶段也排了写入，以完结数据为准
+            pending_creates.pop(unique_id, None)
+            pending_updates.pop(unique_id, None)
+            if not changed:
+                # 飞书中已是最终数据，不调用接口直接完结
+                state.update_cache(unique_id, utime=u_time_ms)
+                state.add_synced(unique_id)
+                state.add_finalized(unique_id)
+                continue
+            log_info(f"  -> 🔵 订单完结: {fields['币种']} (Batch)")
+            # 平仓时间 (utime) 供成交账本判断成交是否属于该仓位
+            pending_updates[unique_id] = (record_id, changed,
+                                          {"h": dict(last_hashes or {}, **hashes), "utime": u_time_ms}, True)
         else:
-            log_info(f"  -> 🟣 补录历史: {fields['币种']} (API Call)")
-            new_id = feishu_client.create_record(fields)
-            if new_id:
-                synced_ids.add(unique_id)
-                finalized_ids.add(unique_id)
+            log_info(f"  -> 🟣 补录历史: {fields['币种']} (Batch)")
+            pending_creates[unique_id] = (fields, {"h": hashes, "utime": u_time_ms}, True)
+
+    analytics.append_closed(account.history_export, closed)
+
+
+def fetch_snapshot(account: SyncAccount):
+    """
+    从 Bitget 拉取单个账户的当前持仓与增量历史仓位
+    并发请求 (同一事件循环, 耗时约等于最慢的请求)，失败返回 None
+    """
+    try:
+        return account.bitget.fetch_snapshot(get_history_since_all(account.state), get_history_resume_all(account.state),
+                                             with_marks=mark_refresh_due(account))
+    except Exception as e:
+        print(f"[Bitget] 获取数据失败: {e}")
+        return None
+
+
+def fetch_all(accounts: list) -> list:
+    """
+    流水线第一段: 所有账户在同一个事件循环上并发拉取 (到了浮动盈亏刷新间隔的账户连同标记价格)
+    返回 [(account, snapshot)]，拉取失败的账户不在其中
+    """
+    print(f"\n[{datetime.now().strftime('%H:%M:%S')}] 开始同步 (间隔: {POLL_INTERVAL}s)...")
+    try:
+        snapshots = bitget_client.fetch_all([(account.bitget, get_history_since_all(account.state),
+                                              get_history_resume_all(account.state), mark_refresh_due(account))
+                                             for account in accounts])
+    except Exception as e:
+        print(f"[Bitget] 获取数据失败: {e}")
+        return []
+    return [(account, snapshot) for account, snapshot in zip(accounts, snapshots) if snapshot is not None]
+
+
+def process_snapshot(account: SyncAccount, open_positions: list, history_by_type: dict, marks: dict = None):
+    """
+    流水线第二段: 对一份快照做本地比对，把需要的飞书写入交给发件箱 (第三段)
+    open_positions 为全部合约类型的持仓，history_by_type 为 {product_type: 历史仓位列表}，
+    marks 为随快照拉取的标记价格 (本周期未拉取时为 None)
+    """
+    # 智能缓存 (state.feishu_cache)：不仅存 Record ID，还存关键状态 (Entry Price, Leverage)
+    # 用于本地对比，决定是否需要调用 API 更新
+    # 已完结 ID 集合 (state.finalized_ids) 防止重复更新历史
+    state = account.state
+    ensure_contracts(account)
+
+    # state 丢失 (缓存为空) 时一次性预取索引，避免逐条 search
+    if not state.feishu_cache and account.record_index is None:
+        account.prefetch_record_index()
+
+    # 本周期待写入飞书的变更，按 unique_id 去重，最后统一批量提交
+    # pending_creates: {unique_id: (fields, cache_fields, finalize)}
+    # pending_updates: {unique_id: (record_id, fields, cache_fields, finalize)}
+    pending_creates = {}
+    pending_updates = {}
+
+    # ==========================
+    # 1. 同步当前持仓 (Open Positions)
+    # ==========================
+    current_holding_ids = sync_open_positions(account, open_positions, pending_creates, pending_updates)
+    if marks is not None or mark_refresh_due(account):
+        refresh_marks(account, open_positions, pending_updates, marks)
+
+    # ==========================
+    # 2. 同步历史仓位 (History Positions)
+    # ==========================
+    sync_history_positions(account, merge_history(history_by_type), pending_creates, pending_updates)
+
+    # ==========================
+    # 3. 批量写入飞书 (交给发件箱后台发送，不阻塞下一份快照)
+    # ==========================
+    flush_writes(account, pending_creates, pending_updates)
 
     # 保存最终状态
-    state["feishu_cache"] = feishu_cache
-    state["finalized_ids"] = list(finalized_ids)
-    state["synced_ids"] = list(synced_ids)
-    state["last_sync_time"] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    advance_history_cursor(account, history_by_type)
+    track_open_ids(state, current_holding_ids)
+    state.set_meta("last_sync_time", datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
     save_state(state)
 
 
-if __name__ == "__main__":
-    log_info(f"启动智能同步模式 (API 节约版)")
-    log_info(f"轮询间隔: {POLL_INTERVAL} 秒")
+def sync_tasks(account: SyncAccount):
+    """串行执行一次完整同步 (ws 模式的 REST 对账使用)"""
+    snapshot = fetch_snapshot(account)
+    if snapshot is not None:
+        process_snapshot(account, *snapshot)
+
+
+def run_fetch_stage(accounts: list, snapshots: queue.Queue, stop: threading.Event):
+    """
+    拉取线程: 按固定频率 (而不是 "处理完再等 POLL_INTERVAL") 拉取快照放入有界队列
+    处理跟不上时丢弃队列中过期的快照，只保留最新的一份
+    """
+    next_run = time.monotonic()
+    while not stop.is_set():
+        batch = fetch_all(accounts)
+        if batch:
+            while True:
+                try:
+                    snapshots.put_nowait(batch)
+                    break
+                except queue.Full:
+                    try:
+                        snapshots.get_nowait()
+                        print("[Core] 处理落后，丢弃过期快照")
+                    except queue.Empty:
+                        pass
+        next_run += POLL_INTERVAL
+        now = time.monotonic()
+        # 单次拉取超过一个周期时不补跑错过的节拍
+        if next_run < now:
+            next_run = now
+        stop.wait(next_run - now)
+
+
+def run_poll_mode(accounts: list):
+    """
+    轮询模式流水线: 拉取 (后台线程) -> 比对 (当前线程) -> 飞书写入 (各账户的发件箱线程)
+    三段通过有界队列连接，下一份快照的拉取与上一份的处理 / 写入重叠进行
+    """
+    snapshots = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    stop = threading.Event()
+    fetcher = threading.Thread(target=run_fetch_stage, args=(accounts, snapshots, stop),
+                               name="bitget-fetch", daemon=True)
+    fetcher.start()
+    try:
+        while True:
+            try:
+                batch = snapshots.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                continue
+            for account, snapshot in batch:
+                try:
+                    process_snapshot(account, *snapshot)
+                except Exception as e:
+                    log_error(f"主循环异常 ({account.name}): {e}")
+    finally:
+        stop.set()
+
+
+def apply_position_snapshot(account: SyncAccount, open_positions: list) -> set:
+    """
+    ws 模式: 用推送的持仓快照做一次持仓决策 (不调用 Bitget REST)
+    返回相对上一次快照消失的 unique_id 集合 (已平仓，需要拉历史)
+    """
+    state = account.state
+    ensure_contracts(account)
+    pending_creates = {}
+    pending_updates = {}
+    current_holding_ids = sync_open_positions(account, open_positions, pending_creates, pending_updates)
+    if mark_refresh_due(account):
+        refresh_marks(account, open_positions, pending_updates)
+    flush_writes(account, pending_creates, pending_updates)
+
+    closed_ids = set(state.get_meta("open_ids", [])) - current_holding_ids
+    track_open_ids(state, current_holding_ids)
+    save_state(state)
+    return closed_ids
+
+
+def apply_history_update(account: SyncAccount):
+    """ws 模式: 有平仓事件时按高水位增量拉取历史仓位并完结"""
+    state = account.state
+    ensure_contracts(account)
+    history_by_type = account.bitget.fetch_history(get_history_since_all(state), get_history_resume_all(state))
+    pending_creates = {}
+    pending_updates = {}
+    sync_history_positions(account, merge_history(history_by_type), pending_creates, pending_updates)
+    flush_writes(account, pending_creates, pending_updates)
+    advance_history_cursor(account, history_by_type)
+    track_open_ids(state)
+    save_state(state)
+
+
+def run_ws_mode(account: SyncAccount):
+    """
+    事件驱动模式
+    WS 线程只负责把推送放进队列，决策和写入都在当前线程串行执行；
+    队列空闲超过 RECONCILE_INTERVAL 时做一次完整的 REST 对账
+    """
+    import ws_sync
+
+    # 先做一次 REST 全量同步: WS 连不上时本轮重建之前数据也是最新的
+    sync_tasks(account)
+    last_reconcile = time.monotonic()
+
+    events = queue.Queue()
+    source = ws_sync.PositionEventSource(events, account.bitget)
+    try:
+        source.start(WS_READY_TIMEOUT)
+        log_info(f"WebSocket 事件模式已启动: {account.name} (REST 对账间隔: {RECONCILE_INTERVAL} 秒)")
+        _ws_event_loop(account, events, last_reconcile)
+    finally:
+        # 异常退出时关闭连接，重建时不会留下仍在重连的旧客户端
+        source.stop()
+
+
+def _ws_event_loop(account: SyncAccount, events: queue.Queue, last_reconcile: float):
+    import ws_sync
+
+    # 已平仓但历史中还没查到的仓位 {positionId: 首次发现的时间}
+    awaiting_close = {}
     while True:
+        timeout = last_reconcile + RECONCILE_INTERVAL - time.monotonic()
+        if awaiting_close:
+            timeout = min(timeout, CLOSE_RETRY_INTERVAL)
+        if MTM_INTERVAL > 0:
+            timeout = min(timeout, account.last_mark_refresh + MTM_INTERVAL - time.monotonic())
         try:
-            sync_tasks()
-            log_info(f"等待 {POLL_INTERVAL} 秒...")
-            time.sleep(POLL_INTERVAL)
-        except KeyboardInterrupt:
-            log_info("程序停止")
-            break
+            batch = [events.get(timeout=max(timeout, 0))]
+        except queue.Empty:
+            batch = []
+
+        # 合并积压的事件: 持仓快照只保留最新一份
+        while True:
+            try:
+                batch.append(events.get_nowait())
+            except queue.Empty:
+                break
+        latest_positions = None
+        need_history = bool(awaiting_close)
+        for kind, payload in batch:
+            if kind == ws_sync.EVENT_POSITIONS:
+                latest_positions = payload
+            elif kind == ws_sync.EVENT_CLOSED:
+                need_history = True
+        # 持仓没有推送时也按间隔刷新浮动盈亏 (复用最近一份持仓快照)
+        if latest_positions is None and mark_refresh_due(account):
+            latest_positions = account.open_positions
+
+        if latest_positions is not None:
+            closed_ids = apply_position_snapshot(account, latest_positions)
+            # 重新出现在持仓快照中的仓位 (此前的快照不完整或推送乱序) 不再等待平仓
+            holding_ids = set(account.state.get_meta("holding_ids", []))
+            awaiting_close = {uid: seen for uid, seen in awaiting_close.items() if uid not in holding_ids}
+            if closed_ids:
+                now = time.monotonic()
+                for uid in closed_ids:
+                    awaiting_close.setdefault(uid, now)
+                need_history = True
+
+        if need_history:
+            apply_history_update(account)
+            expire_before = time.monotonic() - CLOSE_RETRY_TIMEOUT
+            awaiting_close = {uid: seen for uid, seen in awaiting_close.items()
+                              if not account.is_settled(uid) and seen > expire_before}
+
+        if time.monotonic() - last_reconcile >= RECONCILE_INTERVAL:
+            sync_tasks(account)
+            last_reconcile = time.monotonic()
+
+
+def run_ws_forever(account: SyncAccount):
+    """事件循环异常退出后等待一个轮询间隔再重建"""
+    while True:
+        try:
+            run_ws_mode(account)
         except Exception as e:
-            log_error(f"主循环异常: {e}")
-            time.sleep(POLL_INTERVAL) # 出错也等待同样时间
+            log_error(f"事件循环异常 ({account.name}): {e}")
+            time.sleep(POLL_INTERVAL)
+
+
+def warm_up(accounts: list):
+    """
+    启动预热: 飞书 (SDK 导入 + 令牌 + 各账户记录索引)、Bitget 异步连接、合约元数据三路并行，
+    冷启动开销相互重叠，不再串行地压在第一次同步上；关闭预热时只按顺序预取记录索引
+    """
+    def feishu():
+        feishu_client.warm_up()
+        for account in accounts:
+            account.prefetch_record_index()
+
+    if not WARMUP:
+        for account in accounts:
+            account.prefetch_record_index()
+        return
+    start = time.perf_counter()
+    tasks = {
+        "飞书": feishu,
+        "Bitget": lambda: bitget_client.warm_up(accounts[0].bitget),
+        "合约信息": lambda: ensure_contracts(accounts[0]),
+    }
+    with ThreadPoolExecutor(max_workers=len(tasks), thread_name_prefix="warmup") as pool:
+        futures = {name: pool.submit(task) for name, task in tasks.items()}
+        for name, future in futures.items():
+            try:
+                future.result()
+            except Exception as e:
+                print(f"[Core] 预热失败 ({name}): {e}")
+    log_info(f"启动预热完成 ({(time.perf_counter() - start) * 1000:.0f} ms)")
+
+
+def _handle_sigterm(signum, frame):
+    # docker stop 发送 SIGTERM，转成 KeyboardInterrupt 走正常退出流程 (落盘状态)
+    raise KeyboardInterrupt
+
+
+if __name__ == "__main__":
+    log_info(f"启动智能同步模式 (API 节约版)")
+    log_info(f"轮询间隔: {POLL_INTERVAL} 秒 (固定频率)")
+    signal.signal(signal.SIGTERM, _handle_sigterm)
+    accounts = load_accounts()
+    log_info(f"同步账户: {', '.join(account.name for account in accounts)}")
+    warm_up(accounts)
+    for account in accounts:
+        account.start()
+    try:
+        if SYNC_MODE == "ws":
+            # 每个账户一条私有 WS 连接和一个决策线程，主线程只等待退出信号
+            for account in accounts[1:]:
+                threading.Thread(target=run_ws_forever, args=(account,),
+                                 name=f"ws-{account.name}", daemon=True).start()
+            run_ws_forever(accounts[0])
+        else:
+            run_poll_mode(accounts)
+    except KeyboardInterrupt:
+        log_info("程序停止")
+    finally:
+        for account in accounts:
+            account.stop()
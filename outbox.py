@@ -0,0 +1,287 @@
+# outbox.py - 飞书写入发件箱
+# 决策产生的飞书写入先持久化到状态后端，再由后台线程批量发送；
+# 失败的条目按指数退避重试，不需要重新拉取 Bitget 数据或重跑决策
+
+import os
+import threading
+import time
+from dotenv import load_dotenv
+
+import feishu_client
+
+load_dotenv()
+
+# 失败重试的退避 (秒): base * 2^(n-1)，最多 max
+OUTBOX_RETRY_BASE = float(os.getenv("OUTBOX_RETRY_BASE", 5))
+OUTBOX_RETRY_MAX = float(os.getenv("OUTBOX_RETRY_MAX", 300))
+# 单条写入连续失败多少次后移入死信 (不再重试，等待人工处理)
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", 10))
+# 没有到期条目时后台线程的最长休眠 (秒)
+OUTBOX_IDLE_INTERVAL = 60
+
+KIND_CREATE = "create"
+KIND_UPDATE = "update"
+# 死信条目与发件箱存放在同一张表，键加上该前缀
+DEAD_PREFIX = "dead:"
+
+
+def outbox_key(kind: str, unique_id: str, record_id: str = None) -> str:
+    # 更新按 record_id 合并 (同一条记录只发送最新字段)；创建时还没有 record_id，按 unique_id 合并
+    if kind == KIND_UPDATE:
+        return f"{KIND_UPDATE}:{record_id}"
+    return f"{KIND_CREATE}:{unique_id}"
+
+
+class Outbox:
+    """
+    持久化的飞书写入队列
+    - enqueue: 决策结果先写入后端 (SQLite outbox 表 / JSON 日志) 再唤醒后台线程
+    - 同一个 key 的新条目覆盖旧条目，只发送最新的字段
+    - 发送成功后更新 SyncState (缓存 / 已同步 / 已完结)，状态落盘后才删除条目
+    - 首次发送走批量接口；批量被拒绝后，其中的条目改为逐条重试，一条坏记录不会拖住同批的其他写入
+    - 发送失败的条目保留在发件箱中退避重试，进程重启后继续发送；
+      连续失败 OUTBOX_MAX_ATTEMPTS 次后移入死信并打印，不再重试
+    - 结果未知的创建 (重启前从后端恢复的、上次发送失败的) 先用 lookup 确认记录是否已存在，
+      已存在则改为更新该记录，崩溃或超时不会产生重复行
+    """
+
+    def __init__(self, state, on_created=None, table_id: str = None, app_token: str = None, lookup=None):
+        self.state = state
+        self.backend = state.backend
+        # 写入的目标表 (为空时使用 feishu_client 的默认表)
+        self.table_id = table_id
+        self.app_token = app_token
+        # 创建成功的回调 (unique_id, record_id)，用于更新 positionId 索引
+        self.on_created = on_created
+        # 按 unique_id 查询已存在的 record_id (未找到返回 None，查询失败抛出异常)
+        self.lookup = lookup
+        self._lock = threading.Lock()
+        stored = self.backend.load_outbox()
+        self._entries = {key: entry for key, entry in stored.items() if not key.startswith(DEAD_PREFIX)}
+        self._dead = {key[len(DEAD_PREFIX):]: entry for key, entry in stored.items() if key.startswith(DEAD_PREFIX)}
+        self._seq = max((entry.get("seq", 0) for entry in self._entries.values()), default=0)
+        # 重启后立即重试积压的条目
+        for entry in self._entries.values():
+            entry["next_at"] = 0
+        # 从后端恢复的创建: 上次可能已经创建成功，只是没来得及落盘
+        self._unverified = {key for key, entry in self._entries.items() if entry["kind"] == KIND_CREATE}
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        if self._entries:
+            print(f"[飞书] 发件箱中有 {len(self._entries)} 条待发送写入")
+        if self._dead:
+            print(f"[飞书] 死信中有 {len(self._dead)} 条写入 (多次失败，需人工处理): "
+                  f"{', '.join(sorted(entry['unique_id'] for entry in self._dead.values()))}")
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def has_pending_final(self, unique_id: str) -> bool:
+        """
+        该仓位的完结写入是否已在发件箱中 (已持久化，视同完成决策)
+        已进入死信的完结写入同样算作已决策，避免每个周期重新拉取、重新排队
+        """
+        with self._lock:
+            return any(entry["unique_id"] == unique_id and entry.get("finalize")
+                       for entries in (self._entries, self._dead) for entry in entries.values())
+
+    def dead_letters(self) -> list:
+        """死信条目的副本"""
+        with self._lock:
+            return [dict(entry) for entry in self._dead.values()]
+
+    def _merge(self, key: str, entry: dict) -> dict:
+        """调用方持锁: 新字段覆盖旧条目，保留退避进度，完结标记只增不减"""
+        old = self._entries.get(key) or {}
+        self._seq += 1
+        merged = dict(entry)
+        merged["seq"] = self._seq
+        merged["finalize"] = bool(entry.get("finalize") or old.get("finalize"))
+        merged["cache_fields"] = dict(old.get("cache_fields") or {}, **(entry.get("cache_fields") or {}))
+        merged["attempts"] = old.get("attempts", 0)
+        merged["next_at"] = old.get("next_at", 0)
+        self._entries[key] = merged
+        return merged
+
+    def enqueue(self, pending_creates: dict, pending_updates: dict):
+        """
+        pending_creates: {unique_id: (fields, cache_fields, finalize)}
+        pending_updates: {unique_id: (record_id, fields, cache_fields, finalize)}
+        """
+        if not pending_creates and not pending_updates:
+            return
+        changes = {}
+        with self._lock:
+            for unique_id, (fields, cache_fields, finalize) in pending_creates.items():
+                key = outbox_key(KIND_CREATE, unique_id)
+                if self._is_dead(key, fields):
+                    continue
+                changes[key] = self._merge(key, {"kind": KIND_CREATE, "unique_id": unique_id, "record_id": None,
+                                                 "fields": fields, "cache_fields": cache_fields, "finalize": finalize})
+            for unique_id, (record_id, fields, cache_fields, finalize) in pending_updates.items():
+                key = outbox_key(KIND_UPDATE, unique_id, record_id)
+                if self._is_dead(key, fields):
+                    continue
+                changes[key] = self._merge(key, {"kind": KIND_UPDATE, "unique_id": unique_id, "record_id": record_id,
+                                                 "fields": fields, "cache_fields": cache_fields, "finalize": finalize})
+            self.backend.apply_outbox(changes)
+        self._wakeup.set()
+
+    def _is_dead(self, key: str, fields: dict) -> bool:
+        """调用方持锁: 与死信完全相同的写入 (决策每个周期都会重新产生) 不再排队"""
+        dead = self._dead.get(key)
+        return dead is not None and dead.get("fields") == fields
+
+    def _commit(self, entry: dict, record_id: str):
+        unique_id = entry["unique_id"]
+        self.state.update_cache(unique_id, record_id=record_id, **(entry.get("cache_fields") or {}))
+        self.state.add_synced(unique_id)
+        if entry.get("finalize"):
+            # 完结后可以清除 cache 里的过程数据，但为了 ID 映射建议保留
+            self.state.add_finalized(unique_id)
+        if entry["kind"] == KIND_CREATE and self.on_created:
+            self.on_created(unique_id, record_id)
+
+    def _find_existing(self, due: dict) -> tuple:
+        """
+        确认结果未知的创建是否已经写入飞书
+        返回 ({key: 已存在的 record_id}, {查询失败、本轮不发送的 key})
+        """
+        existing = {}
+        skipped = set()
+        if self.lookup is None:
+            return existing, skipped
+        for key, entry in due.items():
+            if entry["kind"] != KIND_CREATE or not (key in self._unverified or entry.get("attempts")):
+                continue
+            try:
+                record_id = self.lookup(entry["unique_id"])
+            except Exception as e:
+                print(f"[飞书] 确认记录是否已存在失败: {entry['unique_id']} ({e})")
+                skipped.add(key)
+                continue
+            if record_id:
+                existing[key] = record_id
+        if existing:
+            print(f"[飞书] {len(existing)} 条待创建的记录已存在，改为更新")
+        return existing, skipped
+
+    def drain(self) -> int:
+        """批量发送所有到期条目，返回发件箱剩余条数"""
+        now = time.time()
+        with self._lock:
+            due = {key: dict(entry) for key, entry in self._entries.items() if entry.get("next_at", 0) <= now}
+        if not due:
+            return len(self)
+
+        results = {}
+        existing, skipped = self._find_existing(due)
+        for key, record_id in existing.items():
+            if feishu_client.update_record(record_id, due[key]["fields"], self.table_id, self.app_token):
+                results[key] = record_id
+        # 首次发送的条目走批量接口；失败过的条目逐条发送，找出被拒绝的那一条
+        creates = [(key, entry) for key, entry in due.items()
+                   if entry["kind"] == KIND_CREATE and not entry.get("attempts")
+                   and key not in existing and key not in skipped]
+        updates = [(key, entry) for key, entry in due.items()
+                   if entry["kind"] == KIND_UPDATE and not entry.get("attempts")]
+        if creates:
+            record_ids = feishu_client.batch_create_records([entry["fields"] for _, entry in creates],
+                                                            self.table_id, self.app_token)
+            for (key, _), record_id in zip(creates, record_ids):
+                results[key] = record_id
+        if updates:
+            updated = set(feishu_client.batch_update_records(
+                [(entry["record_id"], entry["fields"]) for _, entry in updates], self.table_id, self.app_token))
+            for key, entry in updates:
+                results[key] = entry["record_id"] if entry["record_id"] in updated else ""
+        for key, entry in due.items():
+            if not entry.get("attempts") or key in existing or key in skipped:
+                continue
+            if entry["kind"] == KIND_CREATE:
+                results[key] = feishu_client.create_record(entry["fields"], self.table_id, self.app_token)
+            elif feishu_client.update_record(entry["record_id"], entry["fields"], self.table_id, self.app_token):
+                results[key] = entry["record_id"]
+
+        for key, entry in due.items():
+            if results.get(key):
+                self._commit(entry, results[key])
+                self._unverified.discard(key)
+        # 先让同步状态落盘，再删除发件箱条目；崩溃后重发的创建会先经过 _find_existing，不会重复建行
+        self.state.flush()
+
+        changes = {}
+        failed = 0
+        dead = []
+        with self._lock:
+            for key, sent in due.items():
+                current = self._entries.get(key)
+                if current is None:
+                    continue
+                record_id = results.get(key)
+                if record_id:
+                    if current["seq"] == sent["seq"]:
+                        del self._entries[key]
+                        changes[key] = None
+                    elif sent["kind"] == KIND_CREATE:
+                        # 发送期间又排入了新字段: 记录已经创建，改为对新记录的更新
+                        del self._entries[key]
+                        changes[key] = None
+                        update_key = outbox_key(KIND_UPDATE, current["unique_id"], record_id)
+                        changes[update_key] = self._merge(
+                            update_key, dict(current, kind=KIND_UPDATE, record_id=record_id, attempts=0, next_at=0))
+                    # 更新期间又有新字段: 保留新条目，下一轮发送
+                elif current["seq"] == sent["seq"]:
+                    current["attempts"] = current.get("attempts", 0) + 1
+                    if current["attempts"] >= OUTBOX_MAX_ATTEMPTS:
+                        # 多次逐条重试仍失败 (如记录已被手动删除、字段类型不匹配)，移入死信，不再阻塞其他写入
+                        del self._entries[key]
+                        self._dead[key] = current
+                        changes[key] = None
+                        changes[DEAD_PREFIX + key] = current
+                        dead.append(current)
+                        continue
+                    failed += 1
+                    current["next_at"] = now + min(OUTBOX_RETRY_BASE * 2 ** (current["attempts"] - 1),
+                                                   OUTBOX_RETRY_MAX)
+                    changes[key] = current
+            if changes:
+                self.backend.apply_outbox(changes)
+            remaining = len(self._entries)
+        if failed:
+            print(f"[飞书] {failed} 条写入失败，已保留在发件箱中等待重试 (积压 {remaining} 条)")
+        for entry in dead:
+            print(f"[飞书] 写入连续失败 {entry['attempts']} 次，已移入死信: {entry['unique_id']} "
+                  f"({entry['kind']} {entry.get('record_id') or ''})")
+        return remaining
+
+    def _next_delay(self) -> float:
+        with self._lock:
+            if not self._entries:
+                return OUTBOX_IDLE_INTERVAL
+            next_at = min(entry.get("next_at", 0) for entry in self._entries.values())
+        return min(max(next_at - time.time(), 0), OUTBOX_IDLE_INTERVAL)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wakeup.clear()
+            try:
+                self.drain()
+            except Exception as e:
+                print(f"[飞书] 发件箱发送异常: {e}")
+                self._wakeup.wait(OUTBOX_RETRY_BASE)
+                continue
+            self._wakeup.wait(self._next_delay())
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="feishu-outbox", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout: float = 10):
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
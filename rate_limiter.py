@@ -0,0 +1,155 @@
+# rate_limiter.py - 客户端限流
+# Bitget 与飞书共用的按接口令牌桶，带自适应退避
+
+import os
+import time
+import asyncio
+import threading
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# 默认限额 (次/秒, 突发容量)，按 "<api>:<endpoint>" 精确匹配，找不到时回退到 "<api>"
+# 带 "@<账户>" 后缀的键 (见 RateLimiter.scoped) 使用同样的限额，但各账户独立计数
+DEFAULT_LIMITS = {
+    "bitget": (10.0, 10),
+    "bitget:/api/v2/mix/position/all-position": (5.0, 5),
+    "bitget:/api/v2/mix/position/history-position": (10.0, 5),
+    "feishu": (10.0, 5),
+    "feishu:search": (20.0, 5),
+}
+# 被限流后速率最多降到配置值的比例
+MIN_RATE_FACTOR = 0.1
+# 未给出 Retry-After 时的默认退避 (秒)
+DEFAULT_PENALTY = 1.0
+
+
+def parse_limits(spec: str) -> dict:
+    """
+    解析 RATE_LIMITS 环境变量
+    格式: "feishu=5,bitget:/api/v2/mix/position/history-position=10:5" (key=每秒次数[:突发])
+    """
+    limits = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        key, _, value = item.rpartition("=")
+        rate, _, burst = value.partition(":")
+        limits[key] = (float(rate), int(burst or max(1, int(float(rate)))))
+    return limits
+
+
+class TokenBucket:
+    """
+    令牌桶 (GCRA 实现): reserve() 按到达顺序预约发送时间并返回需要等待的秒数，
+    突发请求被均匀摊开而不是一次性打满再被拒
+    自适应: 触发限流时速率减半并暂停到 Retry-After，之后每次成功缓慢恢复
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.factor = 1.0
+        self._tat = 0.0
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        with self._lock:
+            now = time.monotonic()
+            interval = 1.0 / (self.rate * self.factor)
+            tolerance = (self.burst - 1) * interval
+            send_at = max(now, self._tat - tolerance, self._blocked_until)
+            self._tat = max(self._tat, send_at) + interval
+            return send_at - now
+
+    def penalize(self, retry_after: float = None):
+        with self._lock:
+            self.factor = max(MIN_RATE_FACTOR, self.factor * 0.5)
+            delay = retry_after if retry_after is not None else DEFAULT_PENALTY / self.factor
+            self._blocked_until = max(self._blocked_until, time.monotonic() + delay)
+
+    def reward(self):
+        with self._lock:
+            if self.factor < 1.0:
+                self.factor = min(1.0, self.factor * 1.05)
+
+
+class RateLimiter:
+    """按接口分桶的限流器，同一进程内所有客户端共享一个实例"""
+
+    def __init__(self, limits: dict = None):
+        self.limits = dict(DEFAULT_LIMITS)
+        self.limits.update(limits or {})
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def _bucket(self, key: str) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            with self._lock:
+                bucket = self._buckets.get(key)
+                if bucket is None:
+                    name = key.split("@", 1)[0]
+                    rate, burst = self.limits.get(name) or self.limits.get(name.split(":", 1)[0], (10.0, 5))
+                    bucket = self._buckets[key] = TokenBucket(rate, burst)
+        return bucket
+
+    def acquire(self, key: str):
+        """阻塞直到允许发送"""
+        delay = self._bucket(key).reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+    async def acquire_async(self, key: str):
+        """acquire 的异步版本，不阻塞事件循环"""
+        delay = self._bucket(key).reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def on_rate_limited(self, key: str, retry_after: float = None):
+        print(f"[限流] {key} 触发频率限制，退避 {retry_after if retry_after is not None else '自适应'} 秒")
+        self._bucket(key).penalize(retry_after)
+
+    def on_success(self, key: str):
+        self._bucket(key).reward()
+
+    def scoped(self, scope: str) -> "ScopedRateLimiter":
+        """Bitget 按 UID 限频: 每个账户使用独立的令牌桶"""
+        return ScopedRateLimiter(self, scope)
+
+
+class ScopedRateLimiter:
+    """给所有键加上 "@<scope>" 后缀的 RateLimiter 视图，接口与 RateLimiter 相同"""
+
+    def __init__(self, parent: RateLimiter, scope: str):
+        self.parent = parent
+        self.scope = scope
+
+    def acquire(self, key: str):
+        self.parent.acquire(f"{key}@{self.scope}")
+
+    async def acquire_async(self, key: str):
+        await self.parent.acquire_async(f"{key}@{self.scope}")
+
+    def on_rate_limited(self, key: str, retry_after: float = None):
+        self.parent.on_rate_limited(f"{key}@{self.scope}", retry_after)
+
+    def on_success(self, key: str):
+        self.parent.on_success(f"{key}@{self.scope}")
+
+
+def retry_after_from_headers(headers) -> float:
+    """从响应头中解析退避时间 (Retry-After / 飞书 x-ogw-ratelimit-reset)"""
+    if not headers:
+        return None
+    for name in ("Retry-After", "retry-after", "x-ogw-ratelimit-reset"):
+        value = headers.get(name)
+        if value:
+            try:
+                return float(value)
+            except (TypeError, ValueError):
+                continue
+    return None
+
+
+# 进程级共享实例
+limiter = RateLimiter(parse_limits(os.getenv("RATE_LIMITS", "")))
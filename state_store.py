@@ -0,0 +1,366 @@
+# state_store.py - 同步状态存储后端
+# 负责 feishu_cache / synced_ids / finalized_ids 等同步状态的持久化
+
+import os
+import copy
+import json
+import sqlite3
+import threading
+import time
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# 后端选择: sqlite (默认) / json
+STATE_BACKEND = os.getenv("STATE_BACKEND", "sqlite").lower()
+STATE_FILE = os.getenv("STATE_FILE", "state.json")
+STATE_DB = os.getenv("STATE_DB", "state.db")
+# 状态落盘的防抖间隔 (秒)
+STATE_FLUSH_INTERVAL = float(os.getenv("STATE_FLUSH_INTERVAL", 30))
+# JSON 后端: 追加日志累计多少条后压缩成快照
+STATE_JOURNAL_COMPACT = int(os.getenv("STATE_JOURNAL_COMPACT", 200))
+
+# 以独立集合存储的字段，其余键一律放入 meta
+ID_SET_KEYS = ("synced_ids", "finalized_ids")
+
+
+def _dumps(value) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"), sort_keys=True)
+
+
+class JsonStateBackend:
+    """
+    兼容旧版的 JSON 文件后端 (快照 + 追加式日志)
+    - 每次 apply 只向 <path>.journal 追加一行增量并 fsync，代价与变更量成正比
+    - 日志累计到 STATE_JOURNAL_COMPACT 条后压缩: 临时文件 + fsync + rename 原子替换快照，再清空日志
+    - 加载时先读快照再重放日志，进程在任意时刻被杀都不会得到截断的状态
+    - 飞书发件箱 (outbox) 与状态共用同一份快照和日志
+    """
+
+    def __init__(self, path: str = STATE_FILE, compact_every: int = STATE_JOURNAL_COMPACT):
+        self.path = path
+        self.journal_path = path + ".journal"
+        self.compact_every = compact_every
+        self._state = {}
+        self._journal_entries = 0
+        self._can_replace = True
+        # 主循环与发件箱线程都会写入
+        self._lock = threading.RLock()
+
+    def load(self) -> dict:
+        self._state = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    self._state = json.load(f)
+            except Exception as e:
+                print(f"[Core] 加载状态文件失败: {e}")
+        self._journal_entries = self._replay_journal()
+        return self._state
+
+    def _replay_journal(self) -> int:
+        if not os.path.exists(self.journal_path):
+            return 0
+        count = 0
+        valid_size = 0
+        with open(self.journal_path, 'rb') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line.decode('utf-8'))
+                except ValueError:
+                    # 崩溃时写了一半的最后一行，截掉它，之前的都已完整落盘
+                    print("[Core] 状态日志末尾不完整，已截断")
+                    with open(self.journal_path, 'r+b') as wf:
+                        wf.truncate(valid_size)
+                    break
+                if "outbox" in entry:
+                    self._merge_outbox(entry["outbox"])
+                else:
+                    self._merge(entry.get("cache", {}), entry.get("synced", []),
+                                entry.get("finalized", []), entry.get("meta", {}))
+                valid_size += len(line)
+                count += 1
+        if count:
+            print(f"[Core] 重放状态日志: {count} 条")
+        return count
+
+    def _merge(self, cache: dict, synced_ids, finalized_ids, meta: dict):
+        self._state.setdefault("feishu_cache", {}).update(cache)
+        if synced_ids:
+            self._state["synced_ids"] = sorted(set(self._state.get("synced_ids", [])) | set(synced_ids))
+        if finalized_ids:
+            self._state["finalized_ids"] = sorted(set(self._state.get("finalized_ids", [])) | set(finalized_ids))
+        self._state.update(meta)
+
+    def _merge_outbox(self, changes: dict):
+        outbox = self._state.setdefault("outbox", {})
+        for key, entry in changes.items():
+            if entry is None:
+                outbox.pop(key, None)
+            else:
+                outbox[key] = entry
+
+    def _append(self, entry: dict):
+        with open(self.journal_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self._journal_entries += 1
+
+    def apply(self, cache: dict, synced_ids, finalized_ids, meta: dict):
+        with self._lock:
+            self._append({"cache": cache, "synced": list(synced_ids), "finalized": list(finalized_ids), "meta": meta})
+            self._merge(cache, synced_ids, finalized_ids, meta)
+            if self._journal_entries >= self.compact_every:
+                self.compact()
+
+    def load_outbox(self) -> dict:
+        with self._lock:
+            return {key: dict(entry) for key, entry in self._state.get("outbox", {}).items()}
+
+    def apply_outbox(self, changes: dict):
+        """changes: {key: entry}，entry 为 None 表示删除"""
+        with self._lock:
+            self._append({"outbox": changes})
+            self._merge_outbox(changes)
+            if self._journal_entries >= self.compact_every:
+                self.compact()
+
+    def compact(self):
+        """把内存中的完整状态原子写入快照，成功后清空日志"""
+        with self._lock:
+            self._compact()
+
+    def _compact(self):
+        if not self._can_replace:
+            return
+        directory = os.path.dirname(os.path.abspath(self.path))
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._state, f, ensure_ascii=False, separators=(",", ":"))
+            f.flush()
+            os.fsync(f.fileno())
+        try:
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            # Docker 单文件挂载时无法 rename 覆盖；保留日志 (仍可完整恢复)，请改为挂载目录
+            print(f"[Core] 状态快照无法原子替换，停止压缩日志: {e}")
+            self._can_replace = False
+            os.remove(tmp_path)
+            return
+        try:
+            dir_fd = os.open(directory, os.O_RDONLY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+        except OSError:
+            pass
+        # 快照已包含全部日志内容，截断日志
+        with open(self.journal_path, 'w', encoding='utf-8') as f:
+            f.flush()
+            os.fsync(f.fileno())
+        self._journal_entries = 0
+
+
+class SqliteStateBackend:
+    """
+    SQLite (WAL 模式) 后端
+    feishu_cache / synced_ids / finalized_ids 各自一张带主键索引的表，
+    每次只 upsert 发生变化的行
+    首次启动且库为空时自动从旧的 state.json 迁移
+    飞书发件箱存放在 outbox 表，每次变更立即提交
+    """
+
+    def __init__(self, path: str = STATE_DB, json_path: str = STATE_FILE):
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        # 同一连接被主循环与发件箱线程共用, 事务之间需要互斥
+        self._lock = threading.RLock()
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self._create_tables()
+        self._migrate_from_json(json_path)
+
+    def _create_tables(self):
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS feishu_cache ("
+                "unique_id TEXT PRIMARY KEY, record_id TEXT, data TEXT NOT NULL)")
+            for key in ID_SET_KEYS:
+                self.conn.execute(f"CREATE TABLE IF NOT EXISTS {key} (unique_id TEXT PRIMARY KEY)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS outbox (key TEXT PRIMARY KEY, data TEXT NOT NULL)")
+
+    def _migrate_from_json(self, json_path: str):
+        migrated = self.conn.execute("SELECT 1 FROM meta WHERE key = 'migrated_from_json'").fetchone()
+        if migrated or not json_path or not os.path.exists(json_path):
+            return
+        state = JsonStateBackend(json_path).load()
+        if state:
+            print(f"[Core] 从 {json_path} 迁移状态: {len(state.get('feishu_cache', {}))} 条缓存")
+            meta = {k: v for k, v in state.items() if k != "feishu_cache" and k not in ID_SET_KEYS}
+            self.apply(state.get("feishu_cache", {}), state.get("synced_ids", []),
+                       state.get("finalized_ids", []), meta)
+        # 旧文件可能是 Docker 挂载的单文件，不做重命名，只打标记
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('migrated_from_json', '1')")
+
+    def load(self) -> dict:
+        state = {
+            key: json.loads(value) for key, value in self.conn.execute("SELECT key, value FROM meta")
+            if key != "migrated_from_json"
+        }
+        state["feishu_cache"] = {
+            unique_id: json.loads(data) for unique_id, data in self.conn.execute("SELECT unique_id, data FROM feishu_cache")
+        }
+        for key in ID_SET_KEYS:
+            state[key] = [row[0] for row in self.conn.execute(f"SELECT unique_id FROM {key}")]
+        return state
+
+    def apply(self, cache: dict, synced_ids, finalized_ids, meta: dict):
+        with self._lock, self.conn:
+            if cache:
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO feishu_cache (unique_id, record_id, data) VALUES (?, ?, ?)",
+                    [(unique_id, data.get("record_id"), _dumps(data)) for unique_id, data in cache.items()])
+            for key, ids in (("synced_ids", synced_ids), ("finalized_ids", finalized_ids)):
+                if ids:
+                    self.conn.executemany(
+                        f"INSERT OR IGNORE INTO {key} (unique_id) VALUES (?)", [(unique_id,) for unique_id in ids])
+            if meta:
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                    [(key, _dumps(value)) for key, value in meta.items()])
+
+    def load_outbox(self) -> dict:
+        with self._lock:
+            return {key: json.loads(data) for key, data in self.conn.execute("SELECT key, data FROM outbox")}
+
+    def apply_outbox(self, changes: dict):
+        """changes: {key: entry}，entry 为 None 表示删除"""
+        with self._lock, self.conn:
+            self.conn.executemany(
+                "DELETE FROM outbox WHERE key = ?", [(key,) for key, entry in changes.items() if entry is None])
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO outbox (key, data) VALUES (?, ?)",
+                [(key, _dumps(entry)) for key, entry in changes.items() if entry is not None])
+
+
+class SyncState:
+    """
+    进程级常驻的同步状态
+    启动时从后端加载一次，之后所有读写都在内存中完成；
+    修改会记录为脏条目，按防抖间隔 (以及退出时) 只把变化的条目写回后端
+    后台线程 (如飞书写入) 也会修改状态，所有操作都在同一把锁内完成
+    """
+
+    def __init__(self, backend, flush_interval: float = STATE_FLUSH_INTERVAL):
+        self.backend = backend
+        self.flush_interval = flush_interval
+        self._lock = threading.RLock()
+
+        # 深拷贝: JSON 后端压缩快照时会在发件箱线程里遍历它自己的 dict，不能与这里的内存状态共享对象
+        state = copy.deepcopy(backend.load())
+        # 结构: {"unique_id": {"record_id": "xxx", "entry_price": 1.23, "leverage": 20}}
+        self.feishu_cache = state.pop("feishu_cache", {})
+        self.synced_ids = set(state.pop("synced_ids", []))
+        self.finalized_ids = set(state.pop("finalized_ids", []))
+        # 发件箱由 outbox.Outbox 通过 backend.load_outbox 单独加载
+        state.pop("outbox", None)
+        self.meta = state
+
+        self._dirty_cache = set()
+        self._dirty_synced = set()
+        self._dirty_finalized = set()
+        self._dirty_meta = set()
+        self._last_flush = time.monotonic()
+
+    # ---------- 读 ----------
+    def get_cache(self, unique_id: str) -> dict:
+        with self._lock:
+            return self.feishu_cache.get(unique_id)
+
+    def cache_items(self) -> list:
+        """缓存的快照副本 [(unique_id, data)]，供其他线程遍历"""
+        with self._lock:
+            return [(unique_id, dict(data)) for unique_id, data in self.feishu_cache.items()]
+
+    def is_finalized(self, unique_id: str) -> bool:
+        with self._lock:
+            return unique_id in self.finalized_ids
+
+    def get_meta(self, key: str, default=None):
+        with self._lock:
+            return self.meta.get(key, default)
+
+    # ---------- 写 (只标记脏条目) ----------
+    def update_cache(self, unique_id: str, **fields):
+        with self._lock:
+            self.feishu_cache.setdefault(unique_id, {}).update(fields)
+            self._dirty_cache.add(unique_id)
+
+    def add_synced(self, unique_id: str):
+        with self._lock:
+            if unique_id not in self.synced_ids:
+                self.synced_ids.add(unique_id)
+                self._dirty_synced.add(unique_id)
+
+    def add_finalized(self, unique_id: str):
+        with self._lock:
+            if unique_id not in self.finalized_ids:
+                self.finalized_ids.add(unique_id)
+                self._dirty_finalized.add(unique_id)
+
+    def set_meta(self, key: str, value):
+        with self._lock:
+            if self.meta.get(key) != value:
+                self.meta[key] = value
+                self._dirty_meta.add(key)
+
+    @property
+    def dirty(self) -> bool:
+        return bool(self._dirty_cache or self._dirty_synced or self._dirty_finalized or self._dirty_meta)
+
+    # ---------- 持久化 ----------
+    def maybe_flush(self):
+        """防抖: 距离上次落盘超过 flush_interval 才写入"""
+        if self.dirty and time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """把脏条目写回后端，失败时保留脏标记等待下次重试"""
+        with self._lock:
+            if not self.dirty:
+                return
+            cache = {unique_id: dict(self.feishu_cache[unique_id]) for unique_id in self._dirty_cache}
+            meta = {key: self.meta[key] for key in self._dirty_meta}
+            try:
+                self.backend.apply(cache, list(self._dirty_synced), list(self._dirty_finalized), meta)
+            except Exception as e:
+                print(f"[Core] 保存状态失败: {e}")
+                return
+            self._dirty_cache.clear()
+            self._dirty_synced.clear()
+            self._dirty_finalized.clear()
+            self._dirty_meta.clear()
+            self._last_flush = time.monotonic()
+
+
+def _account_path(path: str, account: str) -> str:
+    root, ext = os.path.splitext(path)
+    return f"{root}_{account}{ext}"
+
+
+def get_backend(account: str = None):
+    """
+    根据 STATE_BACKEND 环境变量创建状态后端
+    多账户模式下每个账户一份独立的状态 (state_<账户>.db / state_<账户>.json)，
+    只有默认账户会从旧的 state.json 迁移
+    """
+    state_file = _account_path(STATE_FILE, account) if account else STATE_FILE
+    if STATE_BACKEND == "json":
+        return JsonStateBackend(state_file)
+    if account:
+        return SqliteStateBackend(_account_path(STATE_DB, account), None)
+    return SqliteStateBackend(STATE_DB, STATE_FILE)
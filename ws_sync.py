@@ -0,0 +1,95 @@
+# ws_sync.py - Bitget 私有 WebSocket 事件源
+# 订阅 v2 各合约类型 (bitget_client.PRODUCT_TYPES) 的 positions / orders / fill 频道，
+# 把推送 (客户端已解析好的 dict) 转换成主循环可消费的事件放入队列
+
+import queue
+
+from bitget import consts as c
+from bitget.ws.bitget_ws_client import BitgetWsClient, SubscribeReq
+
+import bitget_client
+
+# 事件类型
+EVENT_POSITIONS = "positions"   # 持仓快照 (payload: 与 REST all-position 同结构的持仓列表)
+EVENT_CLOSED = "closed"         # 有仓位平仓/减仓成交，需要增量拉取历史仓位 (payload: None)
+
+
+def normalize_position(pos: dict) -> dict:
+    """
+    WS positions 频道与 REST all-position 字段名略有不同，统一成 REST 结构
+    以便复用 main.sync_open_positions 的决策逻辑
+    """
+    result = dict(pos)
+    result.setdefault("symbol", pos.get("instId", ""))
+    if "roe" not in result and pos.get("unrealizedPLR") is not None:
+        result["roe"] = pos.get("unrealizedPLR")
+    return result
+
+
+def _is_close_trade(item: dict) -> bool:
+    # orders 频道在下单时也会推送，只关心已成交的；fill 频道没有 status 字段
+    if item.get("status", "filled") not in ("filled", "partially_filled"):
+        return False
+    # 单向持仓模式下 tradeSide 可能是 buy_single / sell_single，只能交给历史接口判断
+    trade_side = str(item.get("tradeSide", ""))
+    if "close" in trade_side or trade_side.endswith("single"):
+        return True
+    return str(item.get("reduceOnly", "")).upper() == "YES"
+
+
+class PositionEventSource:
+    """
+    私有频道事件源
+    - positions: 每次推送是该合约类型的全部持仓，与其他类型最近一次推送合并后转成 EVENT_POSITIONS；
+      所有订阅的合约类型都推送过之后才发出，否则尚未推送的类型的持仓会被当成已平仓
+    - orders / fill: 只在平仓方向的成交时发出 EVENT_CLOSED，由主循环去拉历史
+    回调运行在 WS 线程中，只做解析和入队，决策与写入都在主循环线程完成
+    """
+
+    def __init__(self, events: queue.Queue, account: bitget_client.BitgetAccount = None):
+        self.events = events
+        self.account = account or bitget_client.default_account
+        self.client = None
+        # 各合约类型最近一次推送的持仓 {instType: [...]}
+        self._positions = {}
+
+    def start(self, timeout=None):
+        """连接并登录，timeout 秒内未就绪或登录被拒绝时抛出异常 (连接已关闭)"""
+        self.client = BitgetWsClient(c.V2_WS_PRIVATE_URL, need_login=True) \
+            .api_key(self.account.api_key) \
+            .api_secret_key(self.account.secret_key) \
+            .passphrase(self.account.passphrase) \
+            .error_listener(self._on_error)
+        # 先登记频道，登录成功后客户端会合并成一个 subscribe 帧发送 (重连时同样)
+        product_types = bitget_client.PRODUCT_TYPES
+        self.client.subscribe([SubscribeReq(t, "positions", "default") for t in product_types], self._on_positions)
+        self.client.subscribe([SubscribeReq(t, channel, "default")
+                               for t in product_types for channel in ("orders", "fill")], self._on_trades)
+        self.client.build(timeout)
+        return self
+
+    def stop(self):
+        """关闭连接，停止监督 / 心跳线程"""
+        if self.client is not None:
+            self.client.close()
+
+    def _on_positions(self, payload):
+        try:
+            inst_type = payload.get("arg", {}).get("instType", "").upper()
+            self._positions[inst_type] = [normalize_position(p) for p in payload.get("data", [])]
+            if any(t not in self._positions for t in bitget_client.PRODUCT_TYPES):
+                return
+            positions = [p for group in self._positions.values() for p in group]
+            self.events.put((EVENT_POSITIONS, positions))
+        except Exception as e:
+            print(f"[Bitget] 解析持仓推送失败: {e}")
+
+    def _on_trades(self, payload):
+        try:
+            if any(_is_close_trade(item) for item in payload.get("data", [])):
+                self.events.put((EVENT_CLOSED, None))
+        except Exception as e:
+            print(f"[Bitget] 解析成交推送失败: {e}")
+
+    def _on_error(self, message):
+        print(f"[Bitget] WS 错误: {message}")